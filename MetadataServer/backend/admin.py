@@ -1,9 +1,13 @@
+import json
+
 from django.contrib import admin
 from django.core.urlresolvers import reverse
 from django.utils.html import format_html
 from fsm_admin.mixins import FSMTransitionMixin
+from jsonfield.encoder import JSONEncoder
 
 from backend import models
+from backend.export import zip_response
 
 
 class InstitutionAdmin(admin.ModelAdmin):
@@ -14,9 +18,21 @@ class InstitutionAdmin(admin.ModelAdmin):
 
 
 class DraftMetadataAdmin(admin.ModelAdmin):
-    list_display = ['time', 'user', 'document']
-    list_filter = ['time', 'user']
-    search_fields = ['data', 'document__pk']
+    list_display = ['time', 'user', 'document', 'is_snapshot', 'checkpoint']
+    list_filter = ['time', 'user', 'checkpoint']
+    list_select_related = ['user', 'document__owner']
+    search_fields = ['document__pk', 'document__title']
+    readonly_fields = ['revision_data']
+
+    def is_snapshot(self, obj):
+        return obj.base_id is None
+
+    is_snapshot.boolean = True
+
+    def revision_data(self, obj):
+        return format_html("<pre>{0}</pre>", json.dumps(obj.data, indent=2, cls=JSONEncoder))
+
+    revision_data.short_description = "Data"
 
 
 class MetadataTemplateAdmin(admin.ModelAdmin):
@@ -35,6 +51,7 @@ class DocumentAdmin(FSMTransitionMixin, admin.ModelAdmin):
     list_filter = ['status', 'template']
     search_fields = ['title', 'owner__username', 'uuid']
     fsm_field = ['status', ]
+    actions = ['export_xml']
     readonly_fields = ['status', 'action_links']
     inlines = [DocumentAttachmentInline]
     fieldsets = [
@@ -50,6 +67,18 @@ class DocumentAdmin(FSMTransitionMixin, admin.ModelAdmin):
 
     action_links.short_description = "Actions"
 
+    def export_xml(self, request, queryset):
+        return zip_response(queryset)
+
+    export_xml.short_description = "Export selected documents as XML (ZIP)"
+
+
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'recipient_list', 'created', 'attempts', 'next_attempt', 'sent']
+    list_filter = ['sent', 'created']
+    search_fields = ['subject', 'from_email', 'document__pk']
+    readonly_fields = ['created']
+
 
 class DocumentAttachmentAdmin(admin.ModelAdmin):
     list_display = ['document', 'file']
@@ -70,4 +99,5 @@ admin.site.register(models.Document, DocumentAdmin)
 admin.site.register(models.MetadataTemplate, MetadataTemplateAdmin)
 admin.site.register(models.DocumentAttachment, DocumentAttachmentAdmin)
 admin.site.register(models.DraftMetadata, DraftMetadataAdmin)
+admin.site.register(models.OutgoingEmail, OutgoingEmailAdmin)
 admin.site.register(models.ScienceKeyword, ScienceKeywordAdmin)
@@ -0,0 +1,180 @@
+"""
+Benchmarks for the spec engine and export view, see the benchmark_spec
+command.
+
+Records are synthesised from Assets/mcp2-template.xml with the repeated
+sections scaled to a given number of entries.  Each case runs in a forked
+process so its peak memory can be measured on its own.
+"""
+import multiprocessing
+import resource
+import sys
+import time
+import traceback
+import uuid
+from copy import deepcopy
+from os import path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.db import connections, transaction
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from lxml import etree
+
+from backend.export import spec
+from backend.models import Document, DraftMetadata, MetadataTemplate, ScienceKeyword, extract_initial_data
+from backend.xmlutils import data_to_xml, extract_fields, extract_xml_data
+
+TEMPLATE = path.join(settings.PROJECT_ROOT, '..', 'Assets', 'mcp2-template.xml')
+
+# data_to_xml is quadratic in the number of entries, so larger scales (eg.
+# 10000) take minutes and are left to be asked for with --scales
+SCALES = (1, 10, 100, 1000)
+
+
+def party(base, i):
+    entry = deepcopy(base)
+    entry['organisationName'] = "Organisation {0}".format(i)
+    entry['electronicMailAddress'] = "person{0}@example.com".format(i)
+    return entry
+
+
+def synthetic_record(initial_data, entries, keyword_uuids=()):
+    """
+    Template data with each repeated section scaled to a number of entries,
+    and the names of the sections scaled (keywordsTheme only when there are
+    keyword_uuids to fill it with).
+    """
+    data = deepcopy(initial_data)
+    info = data['identificationInfo']
+    info['citedResponsibleParty'] = [party(info['citedResponsibleParty'][0], i) for i in range(entries)]
+    info['pointOfContact'] = [party(info['pointOfContact'][0], i) for i in range(entries)]
+    info['geographicElement'] = [{'westBoundLongitude': str(i % 180),
+                                  'eastBoundLongitude': str(i % 180 + 1),
+                                  'southBoundLatitude': str(-(i % 90)),
+                                  'northBoundLatitude': str(-(i % 90) + 1)}
+                                 for i in range(entries)]
+    info['dataParameters'] = [{'name': "param_{0}".format(i),
+                               'longName': "Parameter {0}".format(i),
+                               'unit': "Unit {0}".format(i),
+                               'parameterMinimumValue': '0',
+                               'parameterMaximumValue': str(i),
+                               'parameterDescription': "Description of parameter {0}".format(i)}
+                              for i in range(entries)]
+    info['keywordsThemeExtra']['keywords'] = ["Theme {0}".format(i) for i in range(entries)]
+    info['keywordsTaxonExtra']['keywords'] = ["Taxon {0}".format(i) for i in range(entries)]
+    # Keep every branch of the template so extract_fields can run on the result
+    info['verticalElement'].update(hasVerticalExtent=True, minimumValue='0', maximumValue='100',
+                                   verticalCRS='EPSG::5715')
+    sections = ['citedResponsibleParty', 'pointOfContact', 'geographicElement', 'dataParameters',
+                'keywordsThemeExtra', 'keywordsTaxonExtra']
+    if keyword_uuids:
+        info['keywordsTheme']['keywords'] = [keyword_uuids[i % len(keyword_uuids)] for i in range(entries)]
+        sections.append('keywordsTheme')
+    return data, sections
+
+
+def fill(template, data):
+    xml = deepcopy(template)
+    data_to_xml(data, xml, spec)
+    return xml
+
+
+def case_data_to_xml(template, data, xml):
+    return lambda: fill(template, data)
+
+
+def case_extract_xml_data(template, data, xml):
+    return lambda: extract_xml_data(xml, spec)
+
+
+def case_extract_fields(template, data, xml):
+    return lambda: extract_fields(xml, spec)
+
+
+def case_export_view(template, data, xml):
+    from frontend.views import export
+
+    user = User.objects.create(username='benchmark-{0}'.format(uuid.uuid4().hex[:16]))
+    with open(TEMPLATE) as f:
+        metadata_template = MetadataTemplate(name='Benchmark', notes='Benchmark')
+        metadata_template.file.save('benchmark-template.xml', File(f))
+    doc = Document.objects.create(template=metadata_template, owner=user, title='Benchmark')
+    DraftMetadata.objects.create(document=doc, user=user, data=data)
+    request = RequestFactory().get('/export/{0}/'.format(doc.uuid))
+
+    def run():
+        request.user = user
+        if hasattr(request, 'export_document'):
+            del request.export_document
+        response = export(request, uuid=str(doc.uuid))
+        return b''.join(response.streaming_content)
+
+    run.cleanup = lambda: metadata_template.file.delete(save=False)
+    return run
+
+
+CASES = (
+    ('data_to_xml', case_data_to_xml),
+    ('extract_xml_data', case_extract_xml_data),
+    ('extract_fields', case_extract_fields),
+    ('export_view', case_export_view),
+)
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on OS X, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_case(make_case, entries, repeat):
+    """
+    Fastest of repeat runs of a case at a scale, and the peak memory of the
+    process above what it started with.  Database changes are rolled back.
+    """
+    template = etree.parse(TEMPLATE)
+    keyword_uuids = [str(u) for u in ScienceKeyword.objects.values_list('UUID', flat=True)[:100]]
+    data, sections = synthetic_record(extract_initial_data(template, spec), entries, keyword_uuids)
+    xml = fill(template, data)
+    start_rss = peak_rss_kb()
+
+    caches = dict(settings.CACHES, benchmark={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'})
+    with override_settings(CACHES=caches, EXPORT_CACHE='benchmark'), transaction.atomic():
+        case = make_case(template, data, xml)
+        try:
+            times = []
+            for i in range(repeat):
+                start = time.time()
+                case()
+                times.append(time.time() - start)
+        finally:
+            if hasattr(case, 'cleanup'):
+                case.cleanup()
+            transaction.set_rollback(True)
+    return {'seconds': min(times), 'peak_kb': peak_rss_kb() - start_rss, 'sections': len(sections)}
+
+
+def run_isolated(make_case, entries, repeat):
+    """
+    run_case in a forked process.
+    """
+    # The child must not share the parent's database connections
+    connections.close_all()
+    parent_end, child_end = multiprocessing.Pipe()
+
+    def target():
+        try:
+            child_end.send(run_case(make_case, entries, repeat))
+        except Exception:
+            child_end.send(traceback.format_exc())
+
+    process = multiprocessing.Process(target=target)
+    process.start()
+    result = parent_end.recv()
+    process.join()
+    if not isinstance(result, dict):
+        raise RuntimeError("Benchmark failed in child process:\n" + result)
+    return result
@@ -0,0 +1,105 @@
+import os
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+
+from django.conf import settings
+from django.core.cache import cache
+from lxml import etree
+
+from backend.timing import timed
+from backend.xmlutils import extract_fields
+
+
+def template_version(template):
+    return template.modified.isoformat()
+
+
+def template_cache_key(template, name):
+    """
+    Cache key for data derived from a template file.
+
+    The key includes the template's modified time, so re-uploading the
+    template (which saves the model) moves everything to fresh keys and the
+    stale entries simply expire.
+    """
+    return "metadata-template:{0}:{1}:{2}".format(name, template.pk, template_version(template))
+
+
+class TemplatePool(object):
+    """
+    In-process LRU pool of parsed template trees.
+
+    Trees are keyed by template pk and version.  The size of each entry is
+    taken to be the size of its source file and the least recently used trees
+    are dropped once the total goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.trees = OrderedDict()
+        self.size = 0
+
+    def get(self, template):
+        key = (template.pk, template_version(template))
+        with self.lock:
+            try:
+                tree, size = self.trees.pop(key)
+            except KeyError:
+                pass
+            else:
+                self.trees[key] = (tree, size)
+                return tree
+
+        path = template.file.path
+        size = os.path.getsize(path)
+        with timed('template'):
+            tree = etree.parse(path)
+
+        with self.lock:
+            for old_key in [k for k in self.trees if k[0] == template.pk]:
+                self.discard(old_key)
+            self.trees[key] = (tree, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self.trees) > 1:
+                self.discard(next(iter(self.trees)))
+        return tree
+
+    def discard(self, key):
+        tree, size = self.trees.pop(key)
+        self.size -= size
+
+    def clear(self):
+        with self.lock:
+            self.trees.clear()
+            self.size = 0
+
+
+template_pool = TemplatePool(settings.TEMPLATE_POOL_MAX_BYTES)
+
+
+def get_template_tree(template):
+    """
+    Parsed template tree shared between requests.  Treat it as read-only.
+    """
+    return template_pool.get(template)
+
+
+def clone_template_tree(template):
+    """
+    Private copy of the parsed template tree, for data_to_xml to write into.
+    """
+    return deepcopy(template_pool.get(template))
+
+
+def get_template_fields(template, spec):
+    """
+    Field descriptors for a template, as returned by extract_fields.
+    """
+    key = template_cache_key(template, 'fields')
+    fields = cache.get(key)
+    if fields is None:
+        fields = extract_fields(get_template_tree(template), spec)
+        cache.set(key, fields, settings.TEMPLATE_CACHE_TIMEOUT)
+    return fields
@@ -1,5 +1,4 @@
 from django.template.loader import render_to_string
-from django.core.mail import send_mail
 
 from django.contrib.sites.models import Site
 from django.conf import settings
@@ -10,6 +9,15 @@ def get_site(doc):
     return doc.template.site or Site.objects.get(id=settings.SITE_ID)
 
 
+def queue_mail(doc, **kwargs):
+    """
+    Queue an email (same arguments as send_mail) to be written to the
+    outbox when doc is saved, in the same transaction.  The send_queued_email
+    command delivers it.
+    """
+    doc.outbox.append(kwargs)
+
+
 def email_manager_submit_alert(doc):
     """
     1. New metadata submitted (email to data manger)
@@ -19,12 +27,12 @@ def email_manager_submit_alert(doc):
         'document': doc,
         'site': site
     }
-    send_mail(subject="New metadata record submitted: {0}".format(doc.uuid),
-              message=render_to_string('email_manager_submit_alert.txt', context),
-              from_email=doc.owner.email,
-              recipient_list=[site.sitecontent.email],
-              fail_silently=False,
-              html_message=render_to_string('email_manager_submit_alert.html', context))
+    queue_mail(doc,
+               subject="New metadata record submitted: {0}".format(doc.uuid),
+               message=render_to_string('email_manager_submit_alert.txt', context),
+               from_email=doc.owner.email,
+               recipient_list=[site.sitecontent.email],
+               html_message=render_to_string('email_manager_submit_alert.html', context))
 
 
 def email_user_submit_confirmation(doc):
@@ -36,12 +44,12 @@ def email_user_submit_confirmation(doc):
         'document': doc,
         'site': site
     }
-    send_mail(subject="Metadata submission confirmed: {0}".format(doc.title),
-              message=render_to_string('email_user_submit_confirmation.txt', context),
-              from_email=site.sitecontent.email,
-              recipient_list=[doc.owner.email],
-              fail_silently=False,
-              html_message=render_to_string('email_user_submit_confirmation.html', context))
+    queue_mail(doc,
+               subject="Metadata submission confirmed: {0}".format(doc.title),
+               message=render_to_string('email_user_submit_confirmation.txt', context),
+               from_email=site.sitecontent.email,
+               recipient_list=[doc.owner.email],
+               html_message=render_to_string('email_user_submit_confirmation.html', context))
 
 
 def email_manager_updated_alert(doc):
@@ -54,12 +62,12 @@ def email_manager_updated_alert(doc):
         'document': doc,
         'site': site
     }
-    send_mail(subject="Metadata edited: {0}".format(doc.uuid),
-              message=render_to_string('email_manager_updated_alert.txt', context),
-              from_email=doc.owner.email,
-              recipient_list=[site.sitecontent.email],
-              fail_silently=False,
-              html_message=render_to_string('email_manager_updated_alert.html', context))
+    queue_mail(doc,
+               subject="Metadata edited: {0}".format(doc.uuid),
+               message=render_to_string('email_manager_updated_alert.txt', context),
+               from_email=doc.owner.email,
+               recipient_list=[site.sitecontent.email],
+               html_message=render_to_string('email_manager_updated_alert.html', context))
 
 
 def email_user_upload_alert(doc):
@@ -72,9 +80,9 @@ def email_user_upload_alert(doc):
         'site': site
     }
     context['portal_record_url'] = Template(site.sitecontent.portal_record_url).render(Context(context)).strip()
-    send_mail(subject="Your data is now available for discovery in the {0}".format(site.sitecontent.portal_title),
-              message=render_to_string('email_user_upload_alert.txt', context),
-              from_email=site.sitecontent.email,
-              recipient_list=[doc.owner.email],
-              fail_silently=False,
-              html_message=render_to_string('email_user_upload_alert.html', context))
+    queue_mail(doc,
+               subject="Your data is now available for discovery in the {0}".format(site.sitecontent.portal_title),
+               message=render_to_string('email_user_upload_alert.txt', context),
+               from_email=site.sitecontent.email,
+               recipient_list=[doc.owner.email],
+               html_message=render_to_string('email_user_upload_alert.html', context))
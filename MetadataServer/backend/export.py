@@ -0,0 +1,259 @@
+"""
+Rendering documents to XML, one at a time (streamed and gzipped) or in
+bulk as a ZIP archive.
+"""
+import datetime
+import hashlib
+import logging
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from lxml import etree
+
+from backend.cache import clone_template_tree, template_version
+from backend.models import BulkExport, ScienceKeyword
+from backend.spec_2_0 import make_spec
+from backend.utils import to_json
+from backend.xmlutils import data_to_xml, compile_spec
+
+logger = logging.getLogger(__name__)
+
+spec = compile_spec(make_spec(science_keyword=ScienceKeyword))
+
+
+def document_xml(template, data, keywords_version=None):
+    """
+    Template tree with data written into it.
+    """
+    xml = clone_template_tree(template)
+    ScienceKeyword.objects.check_labels(keywords_version)
+    data_to_xml(data, xml, spec)
+    return xml
+
+
+def render_xml(template, data):
+    return b''.join(iter_xml(document_xml(template, data)))
+
+
+def export_version(doc, keywords):
+    """
+    Identifies the XML export of a document: its revision, the version of
+    the template it is written into and the version of the science keywords
+    it refers to.  keywords is ScienceKeyword.objects.get_version(), which
+    callers look up once and share.
+    """
+    return "{0}:{1}:{2}:{3}:{4}".format(doc.pk, doc.revision, doc.template_id, template_version(doc.template),
+                                        keywords[0])
+
+
+def export_etag(doc, keywords, *variant):
+    """
+    ETag of a document's export.  variant distinguishes representations
+    of the same version, eg. style and content encoding.
+    """
+    return hashlib.md5(":".join(map(str, (export_version(doc, keywords),) + variant))).hexdigest()
+
+
+def export_last_modified(doc, keywords):
+    return max(filter(None, (doc.updated, doc.template.modified, keywords[1])))
+
+
+def export_chunks(doc, keywords, style=None):
+    """
+    Gzipped XML export of a document's latest draft, as an iterable of
+    chunks (see iter_xml for style).
+
+    Exports are cached in the EXPORT_CACHE backend.  On a miss the document
+    is serialised and compressed incrementally and cached once complete.  A
+    new draft, template upload or science keyword change alters the key, so
+    stale exports are never served and simply expire.
+    """
+    key = "export-xml:{0}:{1}".format(export_version(doc, keywords), style)
+    gz = caches[settings.EXPORT_CACHE].get(key)
+    if gz is not None:
+        return [gz]
+    return render_export(doc, keywords, style, key)
+
+
+def render_export(doc, keywords, style, key):
+    # Written into the template up front, so errors surface before the
+    # response starts; only serialising and compressing is streamed
+    xml = document_xml(doc.template, to_json(doc.latest_draft.data), keywords[0])
+    return cache_chunks(gzip_chunks(iter_xml(xml, style)), key)
+
+
+def cache_chunks(chunks, key):
+    """
+    Pass chunks through, caching them once all have been produced.
+    """
+    done = []
+    for chunk in chunks:
+        done.append(chunk)
+        yield chunk
+    caches[settings.EXPORT_CACHE].set(key, b''.join(done), settings.EXPORT_CACHE_TIMEOUT)
+
+
+def strip_blank_text(root):
+    """
+    Drop whitespace-only text between elements.
+    """
+    for el in root.iter():
+        if len(el) and el.text is not None and not el.text.strip():
+            el.text = None
+        if el.tail is not None and not el.tail.strip():
+            el.tail = None
+
+
+def iter_xml(xml, style=None):
+    """
+    Serialise a document tree as UTF-8 in chunks, one child of the root
+    element at a time.
+
+    style is None to keep the template's layout, 'compact' to drop the
+    whitespace between elements or 'pretty' to indent them.
+    """
+    root = xml.getroot()
+    if style is not None:
+        strip_blank_text(root)
+    pretty = style == 'pretty'
+    # Children serialised on their own redeclare the root's namespaces
+    inherited = [' xmlns:{0}="{1}"'.format(prefix, uri) if prefix else ' xmlns="{0}"'.format(uri)
+                 for prefix, uri in root.nsmap.items()]
+
+    shell = etree.Element(root.tag, dict(root.attrib), nsmap=root.nsmap)
+    start = etree.tostring(shell, encoding='utf-8', xml_declaration=True)
+    yield start[:-2] + b'>' + (b'\n' if pretty else b'')
+    if root.text:
+        yield escape(root.text).encode('utf-8')
+    for child in root:
+        chunk = etree.tostring(child, encoding='utf-8', pretty_print=pretty)
+        head, sep, rest = chunk.partition(b'>')
+        for decl in inherited:
+            head = head.replace(decl, b'', 1)
+        yield head + sep + rest
+    name = etree.QName(root).localname
+    yield b'</{0}>'.format(root.prefix + ':' + name if root.prefix else name)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def gunzip_chunks(chunks):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    yield decompressor.flush()
+
+
+def export_filename(doc):
+    return "{0}.xml".format(doc.uuid)
+
+
+class StreamBuffer(object):
+    """
+    Write-only file object (for ZipFile) which hands back what has been
+    written so far with drain(), so output can be streamed without being
+    held in memory.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def progress_cutoff():
+    return timezone.now() - datetime.timedelta(seconds=settings.BULK_EXPORT_PROGRESS_TIMEOUT)
+
+
+def start_progress(user, token):
+    """
+    Record for a user to follow a bulk export by token with get_progress.
+    """
+    BulkExport.objects.filter(updated__lt=progress_cutoff()).delete()
+    progress, _ = BulkExport.objects.update_or_create(
+        user=user, token=token, defaults={"done": 0, "total": 0, "finished": False})
+    return progress
+
+
+def get_progress(user, token):
+    """
+    Progress of one of a user's bulk exports, or None if there is no such
+    export or it has not been updated for BULK_EXPORT_PROGRESS_TIMEOUT.
+    """
+    progress = BulkExport.objects.filter(user=user, token=token, updated__gte=progress_cutoff()).first()
+    return progress.as_dict() if progress is not None else None
+
+
+def stream_zip(docs, progress=None):
+    """
+    Render the latest draft of each document in a queryset and yield a ZIP
+    archive of the XML files in chunks.
+
+    Documents are loaded and rendered BULK_EXPORT_CHUNK_SIZE at a time.  If
+    a BulkExport is given, progress is recorded in it after each chunk.
+    """
+    chunk_size = settings.BULK_EXPORT_CHUNK_SIZE
+    pks = list(docs.exclude(latest_draft=None).exclude(template=None).values_list('pk', flat=True))
+    report_progress(progress, 0, len(pks))
+
+    stream = StreamBuffer()
+    archive = zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+    for i in range(0, len(pks), chunk_size):
+        chunk = (docs.model.objects
+                 .filter(pk__in=pks[i:i + chunk_size])
+                 .select_related('template', 'latest_draft__base'))
+        write_chunk(archive, chunk)
+        report_progress(progress, min(i + chunk_size, len(pks)), len(pks))
+        yield stream.drain()
+    archive.close()
+    report_progress(progress, len(pks), len(pks), finished=True)
+    yield stream.drain()
+
+
+def zip_response(docs, progress=None):
+    response = StreamingHttpResponse(stream_zip(docs, progress=progress), content_type="application/zip")
+    response['Content-Disposition'] = 'attachment; filename="export.zip"'
+    return response
+
+
+def write_chunk(archive, docs):
+    for doc in docs:
+        info = zipfile.ZipInfo(export_filename(doc), doc.updated.timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        archive.writestr(info, render_xml(doc.template, to_json(doc.latest_draft.data)))
+
+
+def report_progress(progress, done, total, finished=False):
+    logger.info("Bulk export: %d of %d documents written", done, total)
+    if progress is not None:
+        progress.done, progress.total, progress.finished = done, total, finished
+        progress.save()
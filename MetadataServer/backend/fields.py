@@ -0,0 +1,88 @@
+"""
+Compressed storage of JSON data (eg. drafts).
+
+Values are stored as text tagged with the codec that encoded them, so rows
+written with different codecs can live side by side while they are migrated
+(see the recode_drafts command):
+
+  json   canonical JSON as it is, untagged (and what older rows hold)
+  zlib   "zlib:" followed by the base64 of zlib compressed canonical JSON,
+         or plain JSON for values too small to gain from it
+
+Base64 keeps the column a text column on every database.  The compression
+of repetitive draft JSON more than makes up for it.
+"""
+import base64
+import json
+import zlib
+
+from django.conf import settings
+from django.db import models
+
+from backend.utils import encode_json
+
+ZLIB_PREFIX = 'zlib:'
+
+
+def encode_text(text, codec):
+    """
+    Stored form of JSON text.
+    """
+    if codec == 'json':
+        return text
+    if codec == 'zlib':
+        compressed = ZLIB_PREFIX + base64.b64encode(zlib.compress(text.encode('utf-8')))
+        return compressed if len(compressed) < len(text) else text
+    raise ValueError("Unknown codec %r" % codec)
+
+
+def decode_text(stored):
+    """
+    JSON text from its stored form, without decoding the JSON itself.
+    """
+    if stored.startswith(ZLIB_PREFIX):
+        return zlib.decompress(base64.b64decode(stored[len(ZLIB_PREFIX):])).decode('utf-8')
+    return stored
+
+
+def stored_codec(stored):
+    return 'zlib' if stored.startswith(ZLIB_PREFIX) else 'json'
+
+
+class CompressedJSONField(models.TextField):
+    """
+    JSON data stored with a codec, DRAFT_STORAGE_CODEC unless one is given.
+    Values in any codec are decoded transparently.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.codec = kwargs.pop('codec', None)
+        super(CompressedJSONField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(CompressedJSONField, self).deconstruct()
+        if self.codec is not None:
+            kwargs['codec'] = self.codec
+        return name, path, args, kwargs
+
+    def get_codec(self):
+        return self.codec or settings.DRAFT_STORAGE_CODEC
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return None
+        return json.loads(decode_text(value))
+
+    def to_python(self, value):
+        if isinstance(value, basestring):
+            return json.loads(decode_text(value))
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return encode_text(encode_json(value), self.get_codec())
+
+    def value_to_string(self, obj):
+        # Serialised (eg. by dumpdata) as plain JSON
+        return encode_json(self._get_val_from_obj(obj))
@@ -0,0 +1,46 @@
+import time
+from copy import deepcopy
+
+from django.core.management.base import BaseCommand
+
+from backend.cache import get_template_tree
+from backend.export import spec, iter_xml
+from backend.models import Document
+from backend.utils import to_json
+from backend.xmlutils import data_to_xml
+
+
+class Command(BaseCommand):
+    help = "Time XML export (data_to_xml and serialisation) per record for existing documents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=20, dest='documents',
+                            help='Number of documents to export')
+        parser.add_argument('--repeat', type=int, default=5, dest='repeat',
+                            help='Runs per document; the fastest is reported')
+
+    def handle(self, *args, **options):
+        docs = list(Document.objects
+                    .exclude(latest_draft=None).exclude(template=None)
+                    .select_related('template', 'latest_draft__base')[:options['documents']])
+        if not docs:
+            self.stdout.write("No documents to export")
+            return
+        records = [(get_template_tree(doc.template), to_json(doc.latest_draft.data)) for doc in docs]
+
+        fill = serialise = 0
+        for tree, data in records:
+            fill_times, serialise_times = [], []
+            for i in range(options['repeat']):
+                xml = deepcopy(tree)
+                start = time.time()
+                data_to_xml(data, xml, spec)
+                fill_times.append(time.time() - start)
+                start = time.time()
+                b''.join(iter_xml(xml))
+                serialise_times.append(time.time() - start)
+            fill += min(fill_times)
+            serialise += min(serialise_times)
+
+        self.stdout.write("{0} records: data_to_xml {1:.2f} ms, serialise {2:.2f} ms per record".format(
+            len(records), 1000 * fill / len(records), 1000 * serialise / len(records)))
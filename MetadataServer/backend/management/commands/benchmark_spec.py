@@ -0,0 +1,62 @@
+import json
+from os import path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmarks import CASES, SCALES, run_isolated
+
+
+class Command(BaseCommand):
+    help = ("Benchmark extract_xml_data, extract_fields, data_to_xml and the export view on synthetic "
+            "records with repeated sections scaled from 1 to 1,000 entries.  Timings depend on the "
+            "machine, so the baseline is kept locally: run once with --save-baseline to record it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', dest='scales', default=','.join(map(str, SCALES)),
+                            help='Comma separated numbers of entries per repeated section')
+        parser.add_argument('--cases', dest='cases', default=','.join(name for name, case in CASES),
+                            help='Comma separated cases to run')
+        parser.add_argument('--repeat', type=int, default=3, dest='repeat',
+                            help='Runs per case; the fastest is reported')
+        parser.add_argument('--baseline', dest='baseline',
+                            default=path.join(settings.PROJECT_ROOT, 'benchmark-baseline.json'),
+                            help='Baseline results to compare against (not committed, see --save-baseline)')
+        parser.add_argument('--save-baseline', action='store_true', dest='save_baseline',
+                            help='Store these results as the new baseline')
+
+    def handle(self, *args, **options):
+        cases = dict(CASES)
+        names = options['cases'].split(',')
+        unknown = set(names) - set(cases)
+        if unknown:
+            raise CommandError("Unknown cases: {0}".format(', '.join(sorted(unknown))))
+        scales = [int(scale) for scale in options['scales'].split(',')]
+
+        baseline = {}
+        if path.exists(options['baseline']):
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        elif not options['save_baseline']:
+            self.stdout.write("No baseline at {0}, run with --save-baseline to record one".format(
+                options['baseline']))
+
+        self.stdout.write("{0:<18} {1:>7} {2:>10} {3:>12} {4:>13} {5:>10} {6:>9}".format(
+            "Case", "Entries", "ms/record", "records/s", "entries/s", "peak MB", "baseline"))
+        results = {}
+        for name in names:
+            for entries in scales:
+                result = run_isolated(cases[name], entries, options['repeat'])
+                key = "{0}:{1}".format(name, entries)
+                results[key] = result
+                previous = baseline.get(key)
+                self.stdout.write("{0:<18} {1:>7} {2:>10.2f} {3:>12.1f} {4:>13.0f} {5:>10.1f} {6:>9}".format(
+                    name, entries, 1000 * result['seconds'], 1 / result['seconds'],
+                    result['sections'] * entries / result['seconds'], result['peak_kb'] / 1024.0,
+                    "{0:+.0%}".format(result['seconds'] / previous['seconds'] - 1) if previous else "-"))
+
+        if options['save_baseline']:
+            baseline.update(results)
+            with open(options['baseline'], 'w') as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+            self.stdout.write("Baseline saved to {0}".format(options['baseline']))
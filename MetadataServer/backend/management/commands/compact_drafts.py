@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.models import Document, DraftMetadata, draft_delta
+
+
+def stored_size(draft):
+    field = DraftMetadata._meta.get_field('snapshot' if draft.base_id is None else 'delta')
+    return len(field.get_prep_value(getattr(draft, field.name)))
+
+
+class Command(BaseCommand):
+    help = "Re-encode draft history as deltas against periodic snapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                            help='Report the savings without changing anything')
+
+    def handle(self, *args, **options):
+        documents = revisions = before = after = 0
+        for pk in Document.objects.values_list('pk', flat=True).iterator():
+            with transaction.atomic():
+                drafts = list(DraftMetadata.objects
+                              .filter(document_id=pk)
+                              .select_related('base')
+                              .order_by('time'))
+                if not drafts:
+                    continue
+                history = [draft.data for draft in drafts]
+
+                base = None
+                for draft, data in zip(drafts, history):
+                    before += stored_size(draft)
+                    delta = None if base is None else draft_delta(base.snapshot, data, dependents)
+                    if delta is None:
+                        draft.snapshot, draft.base, draft.delta = data, None, None
+                        base, dependents = draft, 0
+                    else:
+                        draft.snapshot, draft.base, draft.delta = None, base, delta
+                        dependents += 1
+                    after += stored_size(draft)
+                    if not options['dry_run']:
+                        DraftMetadata.objects.filter(pk=draft.pk).update(
+                            snapshot=draft.snapshot, base=draft.base, delta=draft.delta)
+
+                documents += 1
+                revisions += len(drafts)
+
+        self.stdout.write("{0} {1} revisions of {2} documents: {3} -> {4} bytes".format(
+            "Would compact" if options['dry_run'] else "Compacted", revisions, documents, before, after))
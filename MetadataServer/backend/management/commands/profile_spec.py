@@ -0,0 +1,46 @@
+from copy import deepcopy
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.cache import get_template_tree
+from backend.export import spec
+from backend.models import Document, MetadataTemplate
+from backend.utils import to_json
+from backend.xmlutils import data_to_xml, extract, tracing
+
+
+class Command(BaseCommand):
+    help = "Profile extraction and export of a template or document, per spec node."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', type=int, dest='template',
+                            help='Template to profile (id); its initial data is exported')
+        parser.add_argument('--document', dest='document',
+                            help='Document to profile (uuid); its latest draft is exported')
+        parser.add_argument('--repeat', type=int, default=10, dest='repeat',
+                            help='Runs to accumulate')
+        parser.add_argument('--limit', type=int, default=30, dest='limit',
+                            help='Number of spec nodes to report')
+
+    def handle(self, *args, **options):
+        if options['document']:
+            doc = Document.objects.select_related('template', 'latest_draft__base').get(uuid=options['document'])
+            template, data = doc.template, to_json(doc.latest_draft.data)
+        elif options['template']:
+            template = MetadataTemplate.objects.get(pk=options['template'])
+            data = template.get_initial_data(spec)
+        else:
+            raise CommandError("Give a --template or --document to profile")
+
+        tree = get_template_tree(template)
+        with tracing() as trace:
+            for i in range(options['repeat']):
+                extract(tree, spec)
+                data_to_xml(data, deepcopy(tree), spec)
+
+        self.stdout.write("{0:<60} {1:>7} {2:>8} {3:>10} {4:>7} {5:>10} {6:>10}".format(
+            "Spec node", "XPaths", "Matches", "XPath ms", "Calls", "Calls ms", "Total ms"))
+        for label, stats in trace.hot_paths()[:options['limit']]:
+            self.stdout.write("{0:<60} {1:>7} {2:>8} {3:>10.2f} {4:>7} {5:>10.2f} {6:>10.2f}".format(
+                label or "(root)", stats.xpath_calls, stats.matches, 1000 * stats.xpath_time,
+                stats.calls, 1000 * stats.call_time, 1000 * stats.time))
@@ -0,0 +1,96 @@
+import json
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from backend.fields import decode_text, encode_text, stored_codec
+from backend.models import DraftMetadata
+
+FIELDS = ('snapshot', 'delta')
+
+
+def stored_values(field, pks=None):
+    """
+    (pk, stored text) of the drafts with a value in field, as stored.
+    """
+    qn = connection.ops.quote_name
+    column = '{0}.{1}'.format(qn(DraftMetadata._meta.db_table), qn(field))
+    drafts = DraftMetadata.objects.exclude(**{field: None}).order_by('pk')
+    if pks is not None:
+        drafts = drafts.filter(pk__in=pks)
+    return drafts.extra(select={'stored': column}).values_list('pk', 'stored')
+
+
+def storage_stats():
+    """
+    Rows, stored bytes and JSON bytes of each field, by codec.
+    """
+    stats = defaultdict(lambda: {'rows': 0, 'stored': 0, 'json': 0})
+    for field in FIELDS:
+        for pk, stored in stored_values(field).iterator():
+            row = stats[field, stored_codec(stored)]
+            row['rows'] += 1
+            row['stored'] += len(stored)
+            row['json'] += len(decode_text(stored))
+    return stats
+
+
+class Command(BaseCommand):
+    help = "Rewrite stored drafts with DRAFT_STORAGE_CODEC, in batches, and report storage sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+                            help='Drafts rewritten per transaction')
+        parser.add_argument('--sleep', type=float, default=0, dest='sleep',
+                            help='Seconds to pause between batches, to go easy on a live database')
+        parser.add_argument('--stats', action='store_true', dest='stats_only',
+                            help='Only report storage sizes')
+
+    def handle(self, *args, **options):
+        self.report()
+        if options['stats_only']:
+            return
+
+        codec = settings.DRAFT_STORAGE_CODEC
+        rewritten = 0
+        last = 0
+        while True:
+            pks = list(DraftMetadata.objects.filter(pk__gt=last).order_by('pk')
+                       .values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            rewritten += self.recode_batch(pks, codec)
+            last = pks[-1]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write("Rewrote {0} values with the {1} codec".format(rewritten, codec))
+        self.report()
+
+    def recode_batch(self, pks, codec):
+        """
+        Rewrite the values of drafts not already stored with codec (saving
+        them stores them with DRAFT_STORAGE_CODEC).
+        """
+        rewritten = 0
+        with transaction.atomic():
+            for field in FIELDS:
+                for pk, stored in list(stored_values(field, pks)):
+                    if stored_codec(stored) == codec:
+                        continue
+                    text = decode_text(stored)
+                    if encode_text(text, codec) == stored:
+                        # Too small to be worth compressing
+                        continue
+                    DraftMetadata.objects.filter(pk=pk).update(**{field: json.loads(text)})
+                    rewritten += 1
+        return rewritten
+
+    def report(self):
+        for (field, codec), row in sorted(storage_stats().items()):
+            self.stdout.write("{0} ({1}): {2} rows, {3} bytes stored, {4} bytes of JSON ({5:.1f}x)".format(
+                field, codec, row['rows'], row['stored'], row['json'],
+                float(row['json']) / row['stored'] if row['stored'] else 0))
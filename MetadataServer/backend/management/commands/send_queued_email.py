@@ -0,0 +1,72 @@
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from backend.models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts):
+    return datetime.timedelta(seconds=settings.EMAIL_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def send_batch(connection, batch_size):
+    """
+    Send up to batch_size due emails over connection.  Returns the number
+    of emails attempted.
+    """
+    batch = list(OutgoingEmail.objects
+                 .filter(sent=None, next_attempt__lte=timezone.now(),
+                         attempts__lt=settings.EMAIL_MAX_ATTEMPTS)[:batch_size])
+    for email in batch:
+        email.attempts += 1
+        try:
+            # Opened explicitly so send_messages leaves it open for the next email
+            connection.open()
+            connection.send_messages([email.email_message(connection)])
+        except Exception as e:
+            logger.warning("Failed to send email %s (attempt %d): %s", email.pk, email.attempts, e)
+            email.last_error = unicode(e)
+            email.next_attempt = timezone.now() + retry_delay(email.attempts)
+            # Start afresh in case the connection is what failed
+            connection.close()
+        else:
+            email.sent = timezone.now()
+            email.last_error = ''
+        email.save(update_fields=['attempts', 'last_error', 'next_attempt', 'sent'])
+    return len(batch)
+
+
+class Command(BaseCommand):
+    help = "Deliver emails waiting in the outbox.  Run one worker at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, dest='batch_size',
+                            help='Emails to fetch from the outbox at a time')
+        parser.add_argument('--loop', action='store_true', dest='loop',
+                            help='Keep polling the outbox instead of exiting when it is empty')
+        parser.add_argument('--interval', type=float, default=10, dest='interval',
+                            help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        connection = get_connection(fail_silently=False)
+        total = 0
+        try:
+            while True:
+                count = send_batch(connection, options['batch_size'])
+                total += count
+                if count < options['batch_size']:
+                    if not options['loop']:
+                        break
+                    # Don't hold an idle SMTP connection between polls
+                    connection.close()
+                    time.sleep(options['interval'])
+        finally:
+            connection.close()
+        self.stdout.write("Attempted {0} emails".format(total))
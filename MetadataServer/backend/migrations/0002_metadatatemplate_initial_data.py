@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metadatatemplate',
+            name='initial_data',
+            field=jsonfield.fields.JSONField(help_text=b'Data extracted from the template file, used to start new documents', null=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+LEVELS = ['Category', 'Topic', 'Term', 'VariableLevel1', 'VariableLevel2', 'VariableLevel3', 'DetailedVariable']
+
+
+def set_paths(apps, schema_editor):
+    ScienceKeyword = apps.get_model('backend', 'ScienceKeyword')
+    for kw in ScienceKeyword.objects.all():
+        levels = [getattr(kw, level) for level in LEVELS if getattr(kw, level)]
+        kw.path = ' | '.join(levels)
+        kw.depth = len(levels)
+        kw.save(update_fields=['path', 'depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_metadatatemplate_initial_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sciencekeyword',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sciencekeyword',
+            name='path',
+            field=models.CharField(default=b'', help_text=b'Materialised path of the keyword (see as_str)', max_length=1024, editable=False, db_index=True),
+        ),
+        migrations.RunPython(set_paths, migrations.RunPython.noop),
+    ]
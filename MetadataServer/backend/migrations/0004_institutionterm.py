@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+
+def search_terms(text):
+    return set(re.findall(r'\w+', text.lower(), re.UNICODE))
+
+
+def index_institutions(apps, schema_editor):
+    Institution = apps.get_model('backend', 'Institution')
+    InstitutionTerm = apps.get_model('backend', 'InstitutionTerm')
+    InstitutionTerm.objects.bulk_create(
+        InstitutionTerm(institution=inst, term=term[:128])
+        for inst in Institution.objects.all()
+        for term in search_terms(inst.organisationName) | search_terms(inst.city))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_sciencekeyword_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstitutionTerm',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('term', models.CharField(max_length=128, db_index=True)),
+                ('institution', models.ForeignKey(related_name='terms', to='backend.Institution')),
+            ],
+        ),
+        migrations.RunPython(index_institutions, migrations.RunPython.noop),
+    ]
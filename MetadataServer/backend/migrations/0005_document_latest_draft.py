@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def set_latest_drafts(apps, schema_editor):
+    Document = apps.get_model('backend', 'Document')
+    DraftMetadata = apps.get_model('backend', 'DraftMetadata')
+    for doc in Document.objects.all():
+        draft = DraftMetadata.objects.filter(document=doc).order_by('-time').first()
+        if draft:
+            Document.objects.filter(pk=doc.pk).update(latest_draft=draft, updated=draft.time)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_institutionterm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='latest_draft',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, editable=False, to='backend.DraftMetadata', null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='updated',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text=b'Time of the latest draft', editable=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='document',
+            index_together=set([('owner', 'status')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='draftmetadata',
+            index_together=set([('document', 'time')]),
+        ),
+        migrations.RunPython(set_latest_drafts, migrations.RunPython.noop),
+    ]
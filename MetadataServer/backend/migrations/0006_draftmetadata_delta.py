@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_document_latest_draft'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='draftmetadata',
+            old_name='data',
+            new_name='snapshot',
+        ),
+        migrations.AlterField(
+            model_name='draftmetadata',
+            name='snapshot',
+            field=jsonfield.fields.JSONField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='draftmetadata',
+            name='base',
+            field=models.ForeignKey(related_name='dependents', on_delete=django.db.models.deletion.DO_NOTHING, blank=True, editable=False, to='backend.DraftMetadata', null=True),
+        ),
+        migrations.AddField(
+            model_name='draftmetadata',
+            name='delta',
+            field=jsonfield.fields.JSONField(null=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import jsonfield.fields
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_draftmetadata_delta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('subject', models.TextField()),
+                ('message', models.TextField()),
+                ('html_message', models.TextField(null=True, blank=True)),
+                ('from_email', models.CharField(max_length=254)),
+                ('recipient_list', jsonfield.fields.JSONField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now, db_index=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('sent', models.DateTimeField(db_index=True, null=True, blank=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, to='backend.Document', null=True)),
+            ],
+            options={
+                'ordering': ['next_attempt'],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='draftmetadata',
+            name='checkpoint',
+            field=models.BooleanField(default=False, help_text=b'Later saves start a new revision', editable=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations
+
+
+def decode_string_snapshots(apps, schema_editor):
+    # Drafts created from an encoded string were stored as a JSON string
+    # rather than an object
+    DraftMetadata = apps.get_model('backend', 'DraftMetadata')
+    for draft in DraftMetadata.objects.filter(base=None).exclude(snapshot=None).iterator():
+        if isinstance(draft.snapshot, basestring):
+            DraftMetadata.objects.filter(pk=draft.pk).update(snapshot=json.loads(draft.snapshot))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_draftmetadata_checkpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(decode_string_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import backend.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_canonical_draft_json'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='draftmetadata',
+            name='delta',
+            field=backend.fields.CompressedJSONField(null=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='draftmetadata',
+            name='snapshot',
+            field=backend.fields.CompressedJSONField(null=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_document_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sciencekeyword',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, db_index=True),
+        ),
+    ]
@@ -1,24 +1,52 @@
 import uuid
 import copy
+import datetime
+import hashlib
 import json
+import re
+from uuid import UUID
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
 from jsonfield import JSONField
+from jsonfield.encoder import JSONEncoder
 from lxml import etree
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 from rest_framework.renderers import JSONRenderer
 
 from django_fsm import FSMField, transition
 
-from backend.utils import to_json
-from backend.xmlutils import extract_xml_data, data_to_xml, extract_fields
+from backend.patch import make_patch, apply_patch
+from backend.utils import to_json, encode_json
+from backend.xmlutils import extract, extract_xml_data, data_to_xml, compile_spec, apply_callable_defaults
+from backend.cache import get_template_tree
+from backend.fields import CompressedJSONField, decode_text
 from backend.emails import *
 from backend.spec_2_0 import make_spec
 
 
+def json_friendly(data):
+    """
+    Data as it would be stored in a draft (ie. in JSON friendly form).
+    """
+    return json.loads(JSONRenderer().render(data))
+
+
+def extract_initial_data(tree, spec):
+    """
+    Extract template data as it would be stored in a draft.
+    """
+    return json_friendly(extract_xml_data(tree, spec))
+
+
 class MetadataTemplate(models.Model):
     name = models.CharField(max_length=128, help_text="Unique name for template.  Used in menus.")
     file = models.FileField("metadata_templates", help_text="XML file used when creating and exporting records")
@@ -27,18 +55,32 @@ class MetadataTemplate(models.Model):
     archived = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
+    initial_data = JSONField(null=True, editable=False,
+                             help_text="Data extracted from the template file, used to start new documents")
 
     def clean(self):
         try:
             tree = etree.fromstring(self.file.read())
-            spec = make_spec(science_keyword=ScienceKeyword)
-            fields = extract_fields(tree, spec)
-            data = extract_xml_data(tree, spec)
+            spec = compile_spec(make_spec(science_keyword=ScienceKeyword))
+            fields, data = extract(tree, spec)
+            data = json_friendly(data)
             # FIXME data_to_xml will validate presence of all nodes in the template, but only when data is fully mocked up
-            data = json.loads(JSONRenderer().render(data))
-            data_to_xml(data, tree, spec, spec['namespaces'], silent=False)
+            data_to_xml(data, tree, spec, silent=False)
         except Exception as e:
             raise ValidationError({'file': e.message})
+        self.initial_data = data
+
+    def get_initial_data(self, spec):
+        """
+        Data for a new document based on this template.
+
+        Templates saved before initial_data was introduced have it
+        extracted and stored on first use.
+        """
+        if self.initial_data is None:
+            self.initial_data = extract_initial_data(get_template_tree(self), spec)
+            MetadataTemplate.objects.filter(pk=self.pk).update(initial_data=self.initial_data)
+        return apply_callable_defaults(copy.deepcopy(self.initial_data), spec)
 
     def __unicode__(self):
         return "{1} (#{0})".format(self.pk, self.name)
@@ -61,6 +103,7 @@ class DocumentManager(models.Manager):
             document=doc,
             user=user,
             data=new_data)
+        orig_doc.checkpoint()
 
         return doc
 
@@ -85,10 +128,17 @@ class Document(models.Model):
     title = models.TextField(default="Untitled")
     owner = models.ForeignKey(User)
     status = FSMField(default=DRAFT, choices=STATUS_CHOICES)
+    latest_draft = models.ForeignKey("DraftMetadata", null=True, blank=True, editable=False,
+                                     related_name='+', on_delete=models.SET_NULL)
+    updated = models.DateTimeField(default=timezone.now, editable=False,
+                                   help_text="Time of the latest draft")
+    revision = models.PositiveIntegerField(default=0, editable=False,
+                                           help_text="Incremented whenever the latest draft is saved or replaced")
 
     objects = DocumentManager()
 
     class Meta:
+        index_together = [('owner', 'status')]
         permissions = (
             ("workflow_reject", "Can reject record in workflow"),
             ("workflow_upload", "Can upload record in workflow"),
@@ -97,6 +147,22 @@ class Document(models.Model):
             ("workflow_recover", "Can recover discarded records in workflow")
         )
 
+    def __init__(self, *args, **kwargs):
+        # Emails queued by transitions, see queue_mail
+        self.outbox = []
+        super(Document, self).__init__(*args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # latest_draft, updated and revision are maintained by DraftMetadata.save, don't clobber them
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in ('latest_draft', 'updated', 'revision')]
+        with transaction.atomic():
+            super(Document, self).save(*args, **kwargs)
+            if self.outbox:
+                OutgoingEmail.objects.bulk_create(OutgoingEmail(document=self, **kw) for kw in self.outbox)
+                self.outbox = []
+
     def short_title(self):
         return self.title[:32] + (self.title[32:] and '..')
 
@@ -144,9 +210,20 @@ class Document(models.Model):
         pass
 
     ########################################################
-    @property
-    def latest_draft(self):
-        return self.draftmetadata_set.all()[0]
+    def checkpoint(self):
+        """
+        Keep the latest draft as it is: the next save starts a new revision
+        rather than being coalesced into it (see DraftMetadataManager).
+        """
+        DraftMetadata.objects.filter(pk=self.latest_draft_id).update(checkpoint=True)
+
+    def refresh_latest_draft(self):
+        self.latest_draft = self.draftmetadata_set.first()
+        if self.latest_draft:
+            self.updated = self.latest_draft.time
+        Document.objects.filter(pk=self.pk).update(latest_draft=self.latest_draft, updated=self.updated,
+                                                   revision=models.F('revision') + 1)
+        self.revision = Document.objects.values_list('revision', flat=True).get(pk=self.pk)
 
     def __unicode__(self):
         return "{0} - {1} ({2})".format(str(self.uuid)[:8], self.short_title(), self.owner.username)
@@ -163,15 +240,251 @@ class Contributor(models.Model):
     user = models.ForeignKey(User)
 
 
+class DraftMetadataManager(models.Manager):
+    def save_revision(self, doc, user, data):
+        """
+        Save data as the latest revision of a document.
+
+        Saves by the same user within DRAFT_COALESCE_WINDOW seconds of the
+        latest revision being created update it in place, unless it has been
+        made a checkpoint (see Document.checkpoint).  Either way the
+        document's revision counter goes up.
+        """
+        latest = doc.latest_draft
+        if (latest is not None and not latest.checkpoint and latest.user_id == user.pk and
+                timezone.now() - latest.time < datetime.timedelta(seconds=settings.DRAFT_COALESCE_WINDOW)):
+            latest.document = doc
+            latest.data = data
+            latest.save()
+            return latest
+        return self.create(document=doc, user=user, data=data)
+
+    def latest_json(self, doc):
+        """
+        Data of a document's latest draft in its canonical encoding, for
+        passing on to clients without decoding and re-encoding it.
+
+        Snapshots are read from the database as stored (decompressed but not
+        decoded).  Deltas have to be applied, so the encoded result is cached
+        (see DraftMetadata.save).
+        """
+        if doc.latest_draft_id is None:
+            return None
+        key = draft_json_cache_key(doc.pk, doc.revision)
+        encoded = cache.get(key)
+        if encoded is not None:
+            return encoded
+        qn = connection.ops.quote_name
+        column = '{0}.{1}'.format(qn(self.model._meta.db_table), qn('snapshot'))
+        snapshot, base_id = (self.filter(pk=doc.latest_draft_id)
+                             .extra(select={'encoded_snapshot': column})
+                             .values_list('encoded_snapshot', 'base_id')[0])
+        if base_id is None:
+            return decode_text(snapshot)
+        encoded = encode_json(self.select_related('base').get(pk=doc.latest_draft_id).data)
+        cache.set(key, encoded, settings.DRAFT_JSON_CACHE_TIMEOUT)
+        return encoded
+
+
+def draft_json_cache_key(doc_pk, revision):
+    return "draft-json:{0}:{1}".format(doc_pk, revision)
+
+
 class DraftMetadata(models.Model):
+    """
+    A revision of a document's data.
+
+    Revisions are stored either in full (snapshot) or as a JSON patch (delta)
+    against the snapshot they are based on.  A new snapshot is taken every
+    DRAFT_SNAPSHOT_INTERVAL revisions, or sooner if the delta would not be
+    much smaller than the data itself, so any revision can be rebuilt from
+    two rows.
+    """
     document = models.ForeignKey("Document")
     user = models.ForeignKey(User, null=True)
     time = models.DateTimeField(auto_now_add=True)
-    data = JSONField()
+    snapshot = CompressedJSONField(null=True, editable=False)
+    base = models.ForeignKey("self", null=True, blank=True, editable=False, related_name='dependents',
+                             on_delete=models.DO_NOTHING)
+    delta = CompressedJSONField(null=True, editable=False)
+    checkpoint = models.BooleanField(default=False, editable=False,
+                                     help_text="Later saves start a new revision")
+
+    objects = DraftMetadataManager()
 
     class Meta:
         verbose_name_plural = "Draft Metadata"
         ordering = ["-time"]
+        index_together = [('document', 'time')]
+
+    def __init__(self, *args, **kwargs):
+        self._data = None
+        super(DraftMetadata, self).__init__(*args, **kwargs)
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.base_id is None:
+                # A copy, so changes to it aren't also made to the snapshot
+                # later revisions are diffed against
+                self._data = copy.deepcopy(self.snapshot)
+            else:
+                self._data = apply_patch(self.base.snapshot, self.delta)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = to_json(value)
+        self.snapshot = self.base = self.delta = None
+
+    def encode(self):
+        """
+        Store data as a delta against the document's current snapshot if
+        that is worthwhile, otherwise as a new snapshot.
+        """
+        data = self.data
+        latest = self.document.latest_draft
+        if latest is not None:
+            base = latest.base if latest.base_id else latest
+            delta = draft_delta(base.snapshot, data, base.dependents.count())
+            if delta is not None:
+                self.snapshot, self.base, self.delta = None, base, delta
+                return
+        # A copy, so later changes to data (eg. through doc.latest_draft)
+        # don't also change the snapshot
+        self.snapshot, self.base, self.delta = copy.deepcopy(data), None, None
+
+    def encode_replaced(self, stored):
+        """
+        Store replaced data the way the revision was stored: as a delta
+        against the same snapshot if that is still worthwhile.
+        """
+        if stored.base_id is not None:
+            delta = draft_delta(stored.base.snapshot, self._data, 0)
+            if delta is not None:
+                self.base, self.delta = stored.base, delta
+                return
+        else:
+            detach_dependents(stored)
+        self.snapshot = copy.deepcopy(self._data)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self._state.adding:
+                self.encode()
+            elif self.snapshot is None and self.base_id is None:
+                # Data replaced on a saved revision
+                self.encode_replaced(DraftMetadata.objects.get(pk=self.pk))
+            super(DraftMetadata, self).save(*args, **kwargs)
+            # Point the document at this draft unless it already has a newer one
+            saved = timezone.now()
+            if (Document.objects
+                    .filter(models.Q(updated__lte=self.time) | models.Q(latest_draft=self), pk=self.document_id)
+                    .update(latest_draft=self, updated=saved, revision=models.F('revision') + 1)):
+                doc = self.document
+                doc.latest_draft, doc.updated = self, saved
+                doc.revision = Document.objects.values_list('revision', flat=True).get(pk=self.document_id)
+                if self.base_id is not None:
+                    # Spare latest_json applying the delta
+                    cache.set(draft_json_cache_key(doc.pk, doc.revision), encode_json(self.data),
+                              settings.DRAFT_JSON_CACHE_TIMEOUT)
+        # data was the caller's object, rebuild it from what was stored when next asked for
+        self._data = None
+
+
+def draft_delta(snapshot, data, dependents):
+    """
+    Delta from a snapshot to data, or None if data should be stored as a new
+    snapshot instead.  dependents is the number of revisions already based
+    on the snapshot.
+    """
+    if dependents >= settings.DRAFT_SNAPSHOT_INTERVAL - 1:
+        return None
+    delta = make_patch(snapshot, data)
+    if len(json.dumps(delta, cls=JSONEncoder)) * 2 >= len(json.dumps(data, cls=JSONEncoder)):
+        return None
+    return delta
+
+
+def detach_dependents(snapshot):
+    """
+    Re-encode the revisions based on a snapshot so it can be changed or
+    deleted.  The oldest of them becomes the new snapshot for the rest.
+    """
+    dependents = list(DraftMetadata.objects.filter(base=snapshot).order_by('time'))
+    if not dependents:
+        return
+    head = dependents[0]
+    head_data = apply_patch(snapshot.snapshot, head.delta)
+    DraftMetadata.objects.filter(pk=head.pk).update(snapshot=head_data, base=None, delta=None)
+    for draft in dependents[1:]:
+        delta = make_patch(head_data, apply_patch(snapshot.snapshot, draft.delta))
+        DraftMetadata.objects.filter(pk=draft.pk).update(base=head, delta=delta)
+
+
+@receiver(pre_delete, sender=DraftMetadata)
+def detach_deleted_draft(sender, instance, **kwargs):
+    if instance.base_id is None:
+        detach_dependents(instance)
+
+
+@receiver(post_delete, sender=DraftMetadata)
+def repoint_latest_draft(sender, instance, **kwargs):
+    # SET_NULL has already cleared the pointer if it was this draft
+    for doc in Document.objects.filter(pk=instance.document_id, latest_draft=None):
+        doc.refresh_latest_draft()
+
+
+class OutgoingEmail(models.Model):
+    """
+    An email waiting in the outbox, see queue_mail and send_queued_email.
+    """
+    document = models.ForeignKey("Document", null=True, on_delete=models.SET_NULL)
+    subject = models.TextField()
+    message = models.TextField()
+    html_message = models.TextField(blank=True, null=True)
+    from_email = models.CharField(max_length=254)
+    recipient_list = JSONField()
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ['next_attempt']
+
+    def __unicode__(self):
+        return self.subject
+
+    def email_message(self, connection=None):
+        msg = EmailMultiAlternatives(self.subject, self.message, self.from_email, self.recipient_list,
+                                     connection=connection)
+        if self.html_message:
+            msg.attach_alternative(self.html_message, 'text/html')
+        return msg
+
+
+class BulkExport(models.Model):
+    """
+    Progress of a user's bulk export, for polling from other requests (see
+    backend.export.stream_zip).
+    """
+    user = models.ForeignKey(User)
+    token = models.CharField(max_length=64, help_text="Chosen by the client to poll progress with")
+    done = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        unique_together = [('user', 'token')]
+
+    def __unicode__(self):
+        return "{0} ({1})".format(self.token, self.user.username)
+
+    def as_dict(self):
+        return {"done": self.done, "total": self.total, "finished": self.finished}
 
 
 class DocumentAttachment(models.Model):
@@ -185,6 +498,22 @@ class DocumentAttachment(models.Model):
         pass
 
 
+class InstitutionManager(models.Manager):
+    def search(self, query):
+        """
+        Institutions with organisation name or city words starting with each
+        word of query.  Those whose name starts with the query rank first.
+        """
+        matches = self.all()
+        for word in search_terms(query):
+            matches = matches.filter(pk__in=InstitutionTerm.objects.filter(term__startswith=word)
+                                     .values('institution'))
+        return matches.annotate(
+            rank=models.Case(models.When(organisationName__istartswith=query.strip(), then=0),
+                             default=1, output_field=models.IntegerField())
+        ).order_by('rank', 'organisationName', 'city')
+
+
 class Institution(models.Model):
     organisationName = models.CharField(max_length=256, verbose_name="organisation name")
     deliveryPoint = models.CharField(max_length=256, verbose_name="street address")
@@ -194,6 +523,8 @@ class Institution(models.Model):
     postalCode = models.CharField(max_length=16, verbose_name="postcode")
     country = models.CharField(max_length=64)
 
+    objects = InstitutionManager()
+
     def to_dict(self):
         return dict(
             organisationName=self.organisationName,
@@ -206,6 +537,94 @@ class Institution(models.Model):
         )
 
 
+def search_terms(text):
+    return set(re.findall(r'\w+', text.lower(), re.UNICODE))
+
+
+class InstitutionTerm(models.Model):
+    """
+    Search index of words in institution names and cities (see InstitutionManager.search).
+    """
+    institution = models.ForeignKey(Institution, related_name='terms')
+    term = models.CharField(max_length=128, db_index=True)
+
+
+@receiver(post_save, sender=Institution)
+def index_institution(sender, instance, **kwargs):
+    instance.terms.all().delete()
+    InstitutionTerm.objects.bulk_create(
+        InstitutionTerm(institution=instance, term=term[:128])
+        for term in search_terms(instance.organisationName) | search_terms(instance.city))
+
+
+class ScienceKeywordManager(models.Manager):
+    def __init__(self):
+        super(ScienceKeywordManager, self).__init__()
+        self.labels = None
+        self.labels_version = None
+
+    def get_label(self, uuid):
+        """
+        Keyword label (see ScienceKeyword.as_str) for a UUID.
+
+        Labels are served from an in-process map that is loaded in one query
+        on first use.  It is dropped when a keyword is saved or deleted in
+        this process, or by check_labels when the vocabulary version shows a
+        change made elsewhere.
+        """
+        labels = self.labels
+        if labels is None:
+            self.labels_version = self.get_version()[0]
+            labels = {kw.UUID: kw.as_str() for kw in self.all()}
+            self.labels = labels
+        uuid = UUID(str(uuid))
+        try:
+            return labels[uuid]
+        except KeyError:
+            # Possibly added by another process since the map was loaded
+            label = self.get(UUID=uuid).as_str()
+            labels[uuid] = label
+            return label
+
+    def clear_labels(self):
+        self.labels = None
+
+    def check_labels(self, version=None):
+        """
+        Drop the label map if the vocabulary has changed since it was loaded.
+        Call before a run of get_label calls, eg. writing a document's XML.
+        version is the current one, if already known.
+        """
+        if self.labels is not None and self.labels_version != (version or self.get_version()[0]):
+            self.clear_labels()
+
+    def get_version(self):
+        """
+        (version, last modified) of the keyword vocabulary.
+
+        Derived in one query from the number of keywords and the latest
+        modified time, so every process agrees on it.  Saving or deleting a
+        keyword changes it (queryset updates, which skip save, don't).
+        """
+        stats = self.aggregate(count=models.Count('pk'), modified=models.Max('modified'))
+        last_modified = stats['modified']
+        version = hashlib.md5("{0}:{1}".format(
+            stats['count'], last_modified.isoformat() if last_modified else '')).hexdigest()[:16]
+        return version, last_modified
+
+    def descendants(self, path=''):
+        if path:
+            return self.filter(path__startswith=path + ScienceKeyword.PATH_SEPARATOR)
+        return self.all()
+
+    def children(self, path='', levels=1):
+        """
+        Keywords `levels` below the keyword at path (or below the root when path is blank).
+        """
+        depth = path.count(ScienceKeyword.PATH_SEPARATOR) + 1 if path else 0
+        return self.descendants(path).filter(depth=depth + levels).order_by('path')
+
+
 class ScienceKeyword(models.Model):
     UUID = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     Category = models.CharField(max_length=128)
@@ -215,14 +634,38 @@ class ScienceKeyword(models.Model):
     VariableLevel2 = models.CharField(max_length=128)
     VariableLevel3 = models.CharField(max_length=128)
     DetailedVariable = models.CharField(max_length=128)
+    path = models.CharField(max_length=1024, db_index=True, editable=False, default="",
+                            help_text="Materialised path of the keyword (see as_str)")
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(default=timezone.now, db_index=True, editable=False)
 
-    def as_str(self):
-        return ' | '.join(filter(
+    objects = ScienceKeywordManager()
+
+    PATH_SEPARATOR = ' | '
+
+    def levels(self):
+        return filter(
             lambda x: x,
             [self.Category, self.Topic, self.Term,
-             self.VariableLevel1, self.VariableLevel2, self.VariableLevel3, self.DetailedVariable]))
+             self.VariableLevel1, self.VariableLevel2, self.VariableLevel3, self.DetailedVariable])
+
+    def as_str(self):
+        return self.PATH_SEPARATOR.join(self.levels())
 
     class Meta:
         ordering = ['Category', 'Topic', 'Term',
                     'VariableLevel1', 'VariableLevel2', 'VariableLevel3',
                     'DetailedVariable']
+
+
+@receiver(pre_save, sender=ScienceKeyword)
+def set_science_keyword_path(sender, instance, **kwargs):
+    # Also runs for raw saves, so fixture loads get their paths too
+    instance.path = instance.as_str()
+    instance.depth = len(instance.levels())
+    instance.modified = timezone.now()
+
+
+@receiver([post_save, post_delete], sender=ScienceKeyword)
+def clear_science_keyword_labels(sender, **kwargs):
+    ScienceKeyword.objects.clear_labels()
@@ -0,0 +1,173 @@
+"""
+JSON patches (RFC 6902) between draft revisions.
+
+make_patch produces add/remove/replace operations for the draft history.
+apply_patch applies any operation (including move, copy and test) to a copy of
+a document, eg. patches sent by the editor when autosaving.
+"""
+from copy import deepcopy
+
+
+class PatchError(Exception):
+    pass
+
+
+def escape(key):
+    return unicode(key).replace('~', '~0').replace('/', '~1')
+
+
+def unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def make_patch(src, dst, path=''):
+    """
+    List of operations turning src into dst.
+
+    Dicts are compared key by key and lists index by index, with items
+    added or removed at the end, so appending to a long list doesn't
+    rewrite it.
+    """
+    if isinstance(src, dict) and isinstance(dst, dict):
+        ops = []
+        for k in src:
+            if k not in dst:
+                ops.append({'op': 'remove', 'path': path + '/' + escape(k)})
+        for k, v in dst.iteritems():
+            if k in src:
+                ops.extend(make_patch(src[k], v, path + '/' + escape(k)))
+            else:
+                ops.append({'op': 'add', 'path': path + '/' + escape(k), 'value': v})
+        return ops
+
+    if isinstance(src, list) and isinstance(dst, list):
+        ops = []
+        common = min(len(src), len(dst))
+        for i in range(common):
+            ops.extend(make_patch(src[i], dst[i], '%s/%d' % (path, i)))
+        for i in range(len(src) - 1, common - 1, -1):
+            ops.append({'op': 'remove', 'path': '%s/%d' % (path, i)})
+        for i in range(common, len(dst)):
+            ops.append({'op': 'add', 'path': path + '/-', 'value': dst[i]})
+        return ops
+
+    if src == dst and (type(src) is type(dst) or
+                       isinstance(src, basestring) and isinstance(dst, basestring)):
+        return []
+    return [{'op': 'replace', 'path': path, 'value': dst}]
+
+
+def resolve(doc, path):
+    """
+    Container and key/index addressed by a JSON pointer.  The root of the
+    document is returned as (None, None).
+    """
+    if path == '':
+        return None, None
+    if not path.startswith('/'):
+        raise PatchError("Invalid path %r" % path)
+    tokens = [unescape(t) for t in path[1:].split('/')]
+    parent = doc
+    for token in tokens[:-1]:
+        parent = child(parent, token, path)
+    key = tokens[-1]
+    if isinstance(parent, list):
+        if key != '-':
+            key = index(parent, key, path)
+    elif not isinstance(parent, dict):
+        raise PatchError("Path %r is not inside an object or array" % path)
+    return parent, key
+
+
+def index(parent, token, path):
+    if not token.isdigit():
+        raise PatchError("Invalid array index in %r" % path)
+    return int(token)
+
+
+def child(parent, token, path):
+    try:
+        if isinstance(parent, list) and not isinstance(token, int):
+            token = index(parent, token, path)
+        return parent[token]
+    except (KeyError, IndexError, TypeError):
+        raise PatchError("Path %r not found" % path)
+
+
+OPERATIONS = ('add', 'remove', 'replace', 'move', 'copy', 'test')
+
+
+def check_op(op):
+    """
+    Raise PatchError unless op is a well formed operation.
+    """
+    if not isinstance(op, dict):
+        raise PatchError("Operation %r is not an object" % (op,))
+    if op.get('op') not in OPERATIONS:
+        raise PatchError("Unsupported operation %r" % (op.get('op'),))
+    pointers = ('path', 'from') if op['op'] in ('move', 'copy') else ('path',)
+    for member in pointers:
+        if not isinstance(op.get(member), basestring):
+            raise PatchError("Operation %r needs a %r string" % (op['op'], member))
+    if op['op'] in ('add', 'replace', 'test') and 'value' not in op:
+        raise PatchError("Operation %r needs a value" % op['op'])
+
+
+def apply_patch(doc, ops):
+    """
+    Apply a list of patch operations to a copy of doc and return the copy.
+    Malformed operations raise PatchError like ones that don't apply.
+    """
+    doc = deepcopy(doc)
+    for op in ops:
+        check_op(op)
+        parent, key = resolve(doc, op['path'])
+        kind = op['op']
+
+        if kind in ('move', 'copy'):
+            if kind == 'move' and (op['path'] + '/').startswith(op['from'] + '/'):
+                raise PatchError("Cannot move %r into itself" % op['from'])
+            source, source_key = resolve(doc, op['from'])
+            value = doc if source is None else child(source, source_key, op['from'])
+            if kind == 'move':
+                if source is None:
+                    raise PatchError("Cannot move the document root")
+                del source[source_key]
+                # Removing the source may have shifted the target
+                parent, key = resolve(doc, op['path'])
+            op = {'op': 'add', 'path': op['path'], 'value': value}
+            kind = 'add'
+
+        if kind == 'test':
+            current = doc if parent is None else child(parent, key, op['path'])
+            if current != op['value']:
+                raise PatchError("Test failed at %r" % op['path'])
+            continue
+
+        if parent is None:
+            if kind in ('add', 'replace'):
+                doc = deepcopy(op['value'])
+                continue
+            raise PatchError("Cannot %s the document root" % kind)
+
+        try:
+            if kind == 'add':
+                if isinstance(parent, list):
+                    if key == '-':
+                        parent.append(deepcopy(op['value']))
+                    elif 0 <= key <= len(parent):
+                        parent.insert(key, deepcopy(op['value']))
+                    else:
+                        raise IndexError
+                else:
+                    parent[key] = deepcopy(op['value'])
+            elif kind == 'remove':
+                del parent[key]
+            elif kind == 'replace':
+                child(parent, key, op['path'])
+                parent[key] = deepcopy(op['value'])
+            else:
+                raise PatchError("Unsupported operation %r" % kind)
+        except (KeyError, IndexError, TypeError):
+            raise PatchError("Path %r not found" % op['path'])
+    return doc
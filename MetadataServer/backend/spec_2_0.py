@@ -238,8 +238,8 @@ def make_spec(**kwargs):
                                                                  '&id=http://gcmdservices.gsfc.nasa.gov/kms/concept/'
                                                                  + x,
                                                              'text':
-                                                                 lambda x: kwargs['science_keyword'].objects.get(
-                                                                     UUID=x).as_str()}}]}]
+                                                                 lambda x: kwargs['science_keyword'].objects.get_label(
+                                                                     x)}}]}]
                         },
                         'required': True,
                         'notes': 'Theme keywords (selecting from controlled list in thesaurus)'
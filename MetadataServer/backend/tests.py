@@ -1,3 +1,323 @@
-from django.test import TestCase
+import json
+import threading
+from copy import deepcopy
+from os import path
+from StringIO import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from lxml import etree
+
+from backend.export import spec
+from backend.fields import decode_text, encode_text, stored_codec
+from backend.management.commands.recode_drafts import stored_values
+from backend.management.commands.send_queued_email import send_batch
+from backend.models import (Document, DraftMetadata, MetadataTemplate, OutgoingEmail, ScienceKeyword,
+                            extract_initial_data)
+from backend.patch import PatchError, apply_patch, make_patch
+from backend.utils import encode_json
+from backend.xmlutils import data_to_xml
+from frontend.models import SiteContent
+
+TEMPLATE = path.join(settings.PROJECT_ROOT, '..', 'Assets', 'mcp2-template.xml')
+
+
+class ConcurrentExportTest(SimpleTestCase):
+    threads = 16
+
+    def setUp(self):
+        self.template = etree.parse(TEMPLATE)
+        initial_data = extract_initial_data(self.template, spec)
+        self.documents = []
+        for i in range(8):
+            data = deepcopy(initial_data)
+            data['identificationInfo']['title'] = "Document {0}".format(i)
+            self.documents.append(data)
+
+    def export(self, data):
+        xml = deepcopy(self.template)
+        data_to_xml(data, xml, spec)
+        return etree.tostring(xml)
+
+    def test_threads_share_compiled_spec(self):
+        expected = [self.export(data) for data in self.documents]
+        results = {}
+
+        def worker(n):
+            try:
+                results[n] = [self.export(data) for data in self.documents]
+            except Exception as e:
+                results[n] = e
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(expected)), len(self.documents))
+        for n in range(self.threads):
+            self.assertEqual(results[n], expected)
+
+
+class DraftStorageTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='drafter')
+        self.doc = Document.objects.create(owner=self.user)
+        self.initial = {'identificationInfo': {'title': "Title", 'abstract': "Abstract"},
+                        'keywords': ["keyword {0}".format(i) for i in range(50)]}
+
+    def revision(self, **changes):
+        data = deepcopy(self.initial)
+        data['identificationInfo'].update(changes)
+        return data
+
+    def reload(self, draft):
+        return DraftMetadata.objects.get(pk=draft.pk)
+
+    def test_small_changes_stored_as_deltas(self):
+        first = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.initial)
+        second = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.revision(abstract="Changed"))
+        self.assertIsNone(first.base_id)
+        self.assertEqual(second.base_id, first.pk)
+        self.assertIsNone(second.snapshot)
+        self.assertEqual(self.reload(first).data, self.initial)
+        self.assertEqual(self.reload(second).data, self.revision(abstract="Changed"))
+
+    @override_settings(DRAFT_SNAPSHOT_INTERVAL=3)
+    def test_snapshot_every_interval(self):
+        drafts = [DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.revision(abstract=str(i)))
+                  for i in range(4)]
+        self.assertEqual([d.base_id is None for d in drafts], [True, False, False, True])
+        for i, draft in enumerate(drafts):
+            self.assertEqual(self.reload(draft).data, self.revision(abstract=str(i)))
+
+    def test_large_changes_stored_as_snapshots(self):
+        DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.initial)
+        draft = DraftMetadata.objects.create(document=self.doc, user=self.user, data={'keywords': []})
+        self.assertIsNone(draft.base_id)
+
+    def test_edits_to_data_are_not_lost(self):
+        first = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.initial)
+        doc = Document.objects.get(pk=self.doc.pk)
+        data = doc.latest_draft.data
+        data['identificationInfo']['abstract'] = "Edited in place"
+        draft = DraftMetadata.objects.create(document=doc, user=self.user, data=data)
+        self.assertEqual(self.reload(draft).data, self.revision(abstract="Edited in place"))
+        self.assertEqual(self.reload(first).data, self.initial)
+
+    def test_edits_through_same_document_are_not_lost(self):
+        first = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.initial)
+        data = self.doc.latest_draft.data
+        data['identificationInfo']['abstract'] = "Edited in place"
+        draft = DraftMetadata.objects.create(document=self.doc, user=self.user, data=data)
+        self.assertEqual(self.reload(draft).data, self.revision(abstract="Edited in place"))
+        self.assertEqual(self.reload(first).data, self.initial)
+
+    def test_deleting_snapshot_reencodes_dependents(self):
+        first = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.initial)
+        rest = [DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.revision(abstract=str(i)))
+                for i in range(3)]
+        first.delete()
+        rest = [self.reload(draft) for draft in rest]
+        self.assertIsNone(rest[0].base_id)
+        self.assertEqual([draft.base_id for draft in rest[1:]], [rest[0].pk] * 2)
+        for i, draft in enumerate(rest):
+            self.assertEqual(draft.data, self.revision(abstract=str(i)))
+
+    def test_replacing_snapshot_reencodes_dependents(self):
+        first = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.initial)
+        second = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.revision(abstract="Second"))
+        first.data = self.revision(title="Replaced")
+        first.save()
+        self.assertEqual(self.reload(first).data, self.revision(title="Replaced"))
+        self.assertEqual(self.reload(second).data, self.revision(abstract="Second"))
+
+    def test_replacing_delta(self):
+        DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.initial)
+        second = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.revision(abstract="Second"))
+        second.data = self.revision(abstract="Replaced")
+        second.save()
+        second = self.reload(second)
+        self.assertIsNotNone(second.base_id)
+        self.assertEqual(second.data, self.revision(abstract="Replaced"))
+
+
+class ApplyPatchTest(SimpleTestCase):
+    doc = {'a': {'b': [1, 2, 3]}, 'c': "d", 'e/f': {'~g': 1}}
+
+    def test_operations(self):
+        self.assertEqual(apply_patch(self.doc, [{'op': 'add', 'path': '/a/b/1', 'value': 9}])['a']['b'], [1, 9, 2, 3])
+        self.assertEqual(apply_patch(self.doc, [{'op': 'add', 'path': '/a/b/-', 'value': 9}])['a']['b'], [1, 2, 3, 9])
+        self.assertNotIn('c', apply_patch(self.doc, [{'op': 'remove', 'path': '/c'}]))
+        self.assertEqual(apply_patch(self.doc, [{'op': 'replace', 'path': '/e~1f/~0g', 'value': 2}])['e/f'], {'~g': 2})
+        moved = apply_patch(self.doc, [{'op': 'move', 'from': '/c', 'path': '/a/c'}])
+        self.assertEqual((moved['a']['c'], 'c' in moved), ("d", False))
+        copied = apply_patch(self.doc, [{'op': 'copy', 'from': '/a/b', 'path': '/x'}])
+        copied['x'].append(4)
+        self.assertEqual(copied['a']['b'], [1, 2, 3])
+        self.assertEqual(apply_patch(self.doc, [{'op': 'test', 'path': '/c', 'value': "d"}]), self.doc)
+
+    def test_does_not_change_document(self):
+        doc = deepcopy(self.doc)
+        apply_patch(doc, [{'op': 'remove', 'path': '/a/b/0'}, {'op': 'replace', 'path': '/c', 'value': 1}])
+        self.assertEqual(doc, self.doc)
+
+    def test_round_trip(self):
+        src = {'a': [1, 2, {'x/y': 'z~'}], 'b': None}
+        dst = {'a': [1, {'x/y': 'q'}], 'c': [1]}
+        self.assertEqual(apply_patch(src, make_patch(src, dst)), dst)
+        self.assertEqual(apply_patch(dst, make_patch(dst, src)), src)
+
+    def test_errors(self):
+        for ops in ([{'op': 'remove', 'path': '/missing'}],
+                    [{'op': 'replace', 'path': '/a/b/7', 'value': 1}],
+                    [{'op': 'test', 'path': '/c', 'value': "x"}],
+                    [{'op': 'move', 'from': '/a', 'path': '/a/b/0'}],
+                    [{'op': 'frobnicate', 'path': '/c'}],
+                    [{'op': 'add', 'path': 'c', 'value': 1}],
+                    [{'op': 'replace', 'path': 1, 'value': 1}],
+                    [{'op': 'copy', 'from': ['a'], 'path': '/x'}],
+                    [{'op': 'add', 'path': '/x'}],
+                    [{'path': '/c'}],
+                    ["remove"]):
+            with self.assertRaises(PatchError):
+                apply_patch(self.doc, ops)
+
+
+class ScienceKeywordVersionTest(TestCase):
+
+    def keyword(self, term):
+        return ScienceKeyword.objects.create(Category="EARTH SCIENCE", Topic="OCEANS", Term=term)
+
+    def test_changes_on_save_and_delete(self):
+        keyword = self.keyword("SALINITY")
+        versions = [ScienceKeyword.objects.get_version()[0]]
+        self.keyword("TIDES")
+        versions.append(ScienceKeyword.objects.get_version()[0])
+        keyword.Term = "OCEAN SALINITY"
+        keyword.save()
+        versions.append(ScienceKeyword.objects.get_version()[0])
+        keyword.delete()
+        versions.append(ScienceKeyword.objects.get_version()[0])
+        self.assertEqual(len(set(versions)), len(versions))
+
+    def test_labels_reloaded_after_change_elsewhere(self):
+        keyword = self.keyword("SALINITY")
+        self.assertEqual(ScienceKeyword.objects.get_label(keyword.UUID), "EARTH SCIENCE | OCEANS | SALINITY")
+        # As saved by another process, whose signals don't reach this one
+        ScienceKeyword.objects.filter(pk=keyword.pk).update(
+            Term="OCEAN SALINITY", path="EARTH SCIENCE | OCEANS | OCEAN SALINITY", modified=timezone.now())
+        ScienceKeyword.objects.check_labels()
+        self.assertEqual(ScienceKeyword.objects.get_label(keyword.UUID), "EARTH SCIENCE | OCEANS | OCEAN SALINITY")
+
+
+class CompressedStorageTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='drafter')
+        self.doc = Document.objects.create(owner=self.user)
+        self.data = {'identificationInfo': {'title': u"T\u00eftle", 'abstract': "Abstract " * 100}}
+
+    def stored(self, draft):
+        return dict(stored_values('snapshot', [draft.pk]))[draft.pk]
+
+    def test_codecs_round_trip(self):
+        text = encode_json(self.data)
+        for codec in ('json', 'zlib'):
+            self.assertEqual(decode_text(encode_text(text, codec)), text)
+        self.assertEqual(stored_codec(encode_text(text, 'zlib')), 'zlib')
+        self.assertEqual(encode_text('{}', 'zlib'), '{}')
+        with self.assertRaises(ValueError):
+            encode_text(text, 'lzma')
+
+    def test_mixed_rows(self):
+        with override_settings(DRAFT_STORAGE_CODEC='json'):
+            plain = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.data)
+        with override_settings(DRAFT_STORAGE_CODEC='zlib'):
+            compressed = DraftMetadata.objects.create(document=self.doc, user=self.user, data={'other': self.data})
+        self.assertEqual(stored_codec(self.stored(plain)), 'json')
+        self.assertEqual(stored_codec(self.stored(compressed)), 'zlib')
+        self.assertEqual(DraftMetadata.objects.get(pk=plain.pk).data, self.data)
+        self.assertEqual(DraftMetadata.objects.get(pk=compressed.pk).data, {'other': self.data})
+        self.assertEqual(json.loads(DraftMetadata.objects.latest_json(Document.objects.get(pk=self.doc.pk))),
+                         {'other': self.data})
+
+    def test_recode_drafts(self):
+        with override_settings(DRAFT_STORAGE_CODEC='json'):
+            draft = DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.data)
+        with override_settings(DRAFT_STORAGE_CODEC='zlib'):
+            call_command('recode_drafts', batch_size=1, stdout=StringIO())
+            self.assertEqual(stored_codec(self.stored(draft)), 'zlib')
+            self.assertEqual(DraftMetadata.objects.get(pk=draft.pk).data, self.data)
+            # Already recoded
+            out = StringIO()
+            call_command('recode_drafts', stdout=out)
+            self.assertIn("Rewrote 0 values", out.getvalue())
+        with override_settings(DRAFT_STORAGE_CODEC='json'):
+            call_command('recode_drafts', stdout=StringIO())
+            self.assertEqual(self.stored(draft), encode_json(self.data))
+
+
+class OutgoingEmailTest(TestCase):
+
+    def setUp(self):
+        SiteContent.objects.create(site=Site.objects.get_current())
+        self.user = User.objects.create(username='submitter', email='submitter@example.com')
+        template = MetadataTemplate.objects.create(name="Template", file='template.xml', notes="")
+        self.doc = Document.objects.create(owner=self.user, template=template)
+
+    def test_queued_when_document_saved(self):
+        self.doc.submit()
+        self.assertEqual(OutgoingEmail.objects.count(), 0)
+        self.doc.save()
+        self.assertEqual(OutgoingEmail.objects.filter(document=self.doc, sent=None).count(), 2)
+
+    def test_discarded_with_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.doc.submit()
+                self.doc.save()
+                raise RuntimeError()
+        self.assertEqual(OutgoingEmail.objects.count(), 0)
+        self.assertEqual(Document.objects.get(pk=self.doc.pk).status, Document.DRAFT)
+
+    def test_send_queued_email(self):
+        self.doc.submit()
+        self.doc.save()
+        call_command('send_queued_email', stdout=StringIO())
+        self.assertEqual(sorted(m.to for m in mail.outbox), [['imas.datamanager@utas.edu.au'],
+                                                              ['submitter@example.com']])
+        self.assertFalse(OutgoingEmail.objects.filter(sent=None).exists())
+        # Already sent
+        call_command('send_queued_email', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_failed_send_retried_later(self):
+        self.doc.submit()
+        self.doc.save()
+
+        class FailingConnection(object):
+            def open(self):
+                pass
+
+            def close(self):
+                pass
+
+            def send_messages(self, messages):
+                raise IOError("Connection refused")
+
+        self.assertEqual(send_batch(FailingConnection(), 10), 2)
+        for email in OutgoingEmail.objects.all():
+            self.assertIsNone(email.sent)
+            self.assertEqual(email.attempts, 1)
+            self.assertEqual(email.last_error, "Connection refused")
+            self.assertGreater(email.next_attempt, timezone.now())
+        self.assertEqual(send_batch(FailingConnection(), 10), 0)
@@ -0,0 +1,147 @@
+"""
+Per-request timing, reported in a Server-Timing header by
+ServerTimingMiddleware.
+
+Code being timed runs inside timed(name) blocks.  Each name is only counted
+once when blocks nest (eg. a serializer serializing nested objects).  The
+names used are:
+
+  db        database queries, see TimedCursorWrapper
+  template  parsing template files
+  spec      extracting from templates and writing XML with the spec
+  serialize REST framework serializers
+  render    rendering the response (eg. to JSON)
+"""
+import json
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorWrapper, CursorDebugWrapper
+
+logger = logging.getLogger(__name__)
+
+local = threading.local()
+
+
+class Timing(object):
+
+    def __init__(self):
+        self.start = timer()
+        self.durations = OrderedDict()
+        self.counts = defaultdict(int)
+        self.depth = defaultdict(int)
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+        self.counts[name] += 1
+
+    def total(self):
+        return timer() - self.start
+
+    def header(self):
+        metrics = ['{0};dur={1:.1f};desc="{2} {3}"'.format(name, 1000 * duration, self.counts[name],
+                                                          'queries' if name == 'db' else 'calls')
+                   for name, duration in self.durations.items()]
+        metrics.append('total;dur={0:.1f}'.format(1000 * self.total()))
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        return {name: {'ms': round(1000 * duration, 1), 'count': self.counts[name]}
+                for name, duration in self.durations.items()}
+
+
+def current_timing():
+    return getattr(local, 'timing', None)
+
+
+@contextmanager
+def timed(name):
+    timing = current_timing()
+    if timing is None or timing.depth[name]:
+        yield
+        return
+    timing.depth[name] += 1
+    start = timer()
+    try:
+        yield
+    finally:
+        timing.depth[name] -= 1
+        timing.add(name, timer() - start)
+
+
+class TimedCursorMixin(object):
+
+    def execute(self, sql, params=None):
+        with timed('db'):
+            return super(TimedCursorMixin, self).execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        with timed('db'):
+            return super(TimedCursorMixin, self).executemany(sql, param_list)
+
+
+class TimedCursorWrapper(TimedCursorMixin, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(TimedCursorMixin, CursorDebugWrapper):
+    pass
+
+
+def instrument(connection):
+    """
+    Make a connection's cursors count towards the 'db' timing.
+    """
+    if not getattr(connection, 'timed_cursors', False):
+        connection.make_cursor = lambda cursor: TimedCursorWrapper(cursor, connection)
+        connection.make_debug_cursor = lambda cursor: TimedCursorDebugWrapper(cursor, connection)
+        connection.timed_cursors = True
+
+
+class TimedSerializerMixin(object):
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super(TimedSerializerMixin, self).to_representation(instance)
+
+
+class ServerTimingMiddleware(object):
+    """
+    Adds a Server-Timing header breaking the request down into the timings
+    above, and logs them as JSON if SERVER_TIMING_LOG is set.
+
+    Streamed responses are timed up to the start of streaming.
+    """
+
+    def process_request(self, request):
+        for connection in connections.all():
+            instrument(connection)
+        local.timing = Timing()
+
+    def process_template_response(self, request, response):
+        timing = current_timing()
+        if timing is not None:
+            start = timer()
+            response.add_post_render_callback(lambda r: timing.add('render', timer() - start))
+        return response
+
+    def process_response(self, request, response):
+        timing = current_timing()
+        if timing is None:
+            return response
+        local.timing = None
+        response['Server-Timing'] = timing.header()
+        if settings.SERVER_TIMING_LOG:
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'ms': round(1000 * timing.total(), 1),
+                'timings': timing.as_dict(),
+            }))
+        return response
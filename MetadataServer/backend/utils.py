@@ -1,8 +1,19 @@
 import json
 
+from jsonfield.encoder import JSONEncoder
+
+# The canonical encoding of draft data: how it is stored (see
+# CompressedJSONField), and so how it can be sent to clients without decoding
+# it (see DraftMetadataManager.latest_json)
+JSON_DUMP_KWARGS = {'cls': JSONEncoder, 'separators': (',', ':')}
+
 
 def to_json(x):
     if isinstance(x, basestring):
         return json.loads(x)
     # Else hope it's already json
     return x
+
+
+def encode_json(x):
+    return json.dumps(x, **JSON_DUMP_KWARGS)
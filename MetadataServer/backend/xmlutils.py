@@ -1,61 +1,290 @@
 import datetime
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
 from decimal import Decimal
 import logging
 import inspect
+import threading
 from copy import deepcopy
+from timeit import default_timer as timer
 
 from django.utils.six import string_types
+from lxml import etree
+
+from backend.timing import timed
 
 logger = logging.getLogger(__name__)
 
 SPECIAL_KEYS = ['namespaces', 'nodes', 'xpath', 'export', 'attributes', 'container', 'parser', 'exportTo', 'keep',
                 'default', 'removeWhen', 'template']
 
+SpecNode = namedtuple('SpecNode', [
+    'path',         # xpath source string, for messages
+    'xpath',        # compiled etree.XPath
+    'container',    # compiled etree.XPath for 'container', falling back to xpath
+    'namespaces',
+    'many',
+    'nodes',        # tuple of (name, SpecNode) pairs or None
+    'keep',
+    'export',
+    'use_default',  # True when extraction yields the default rather than the template value
+    'default',
+    'required',
+    'initial',
+    'parser',
+    'attributes',   # tuple of (attr, f, handler) triples, see attribute_handler
+    'export_to',    # tuple of SpecNodes
+    'batch',        # dict of key -> (SpecNode, data) or None
+    'remove_when',
+    'fanout',
+    'field',        # tuple of (key, value) pairs, the field descriptor base used by extract
+    'label',        # data path of the node (eg. identificationInfo.title), for tracing
+])
+
+CHILDREN_XPATH = etree.XPath('*')
+TEXT_XPATH = etree.XPath('text()')
+
+
+class NodeStats(object):
+    __slots__ = ['xpath_calls', 'xpath_time', 'matches', 'calls', 'call_time']
+
+    def __init__(self):
+        self.xpath_calls = self.matches = self.calls = 0
+        self.xpath_time = self.call_time = 0.0
+
+    @property
+    def time(self):
+        return self.xpath_time + self.call_time
+
+
+class Trace(object):
+    """
+    Per spec node statistics recorded by the walkers while tracing: XPath
+    evaluations, their time and match count, and calls to parsers,
+    attribute functions and defaults and their time.  Keyed by node label.
+    """
+
+    def __init__(self):
+        self.nodes = defaultdict(NodeStats)
 
-def get_value_type(eles):
+    def hot_paths(self):
+        return sorted(self.nodes.iteritems(), key=lambda item: item[1].time, reverse=True)
+
+
+local = threading.local()
+
+
+@contextmanager
+def tracing():
+    """
+    Trace the walkers in this thread for the duration of the block.
+
+        with tracing() as trace:
+            extract_xml_data(tree, spec)
+        trace.hot_paths()
+    """
+    previous = getattr(local, 'trace', None)
+    local.trace = Trace()
     try:
-        return eles[0].getchildren()[0].tag
-    except:
+        yield local.trace
+    finally:
+        local.trace = previous
+
+
+def evaluate(node, xpath, tree):
+    trace = getattr(local, 'trace', None)
+    if trace is None:
+        return xpath(tree)
+    start = timer()
+    result = xpath(tree)
+    stats = trace.nodes[node.label]
+    stats.xpath_time += timer() - start
+    stats.xpath_calls += 1
+    if isinstance(result, list):
+        stats.matches += len(result)
+    return result
+
+
+def call(node, f, *args):
+    trace = getattr(local, 'trace', None)
+    if trace is None:
+        return f(*args)
+    start = timer()
+    try:
+        return f(*args)
+    finally:
+        stats = trace.nodes[node.label]
+        stats.call_time += timer() - start
+        stats.calls += 1
+
+
+def compile_xpath(path, namespaces):
+    if path is None:
         return None
+    return etree.XPath(path, namespaces=namespaces)
 
 
-def extract_fields(tree, spec, **kwargs):
+def compile_spec(spec, namespaces=None, fanout=False, label=''):
+    """
+    Compile a spec (see make_spec) into an immutable tree of SpecNodes.
+
+    XPath expressions are compiled once with their namespaces bound and the
+    per-node flags are resolved up front so the walkers below don't need to
+    re-parse or re-inspect the spec for every document.  Compiled specs are
+    passed through unchanged.
+
+    The walkers never modify a compiled spec, so one can be shared by all
+    requests and threads.
+    """
+    if isinstance(spec, SpecNode):
+        return spec
+
     if isinstance(spec, list):
         spec = spec[0]
         many = True
+        remove_when = None
     else:
         many = False
+        remove_when = spec.get('removeWhen')
+
+    namespaces = spec.get('namespaces', namespaces)
+    path = spec.get('xpath')
+    keep = spec.get('keep', True)
+    export = spec.get('export', True)
+    nested = 'nodes' in spec
+
+    nodes = None
+    if nested:
+        nodes = tuple((k, compile_spec(v, namespaces, label=label + '.' + k if label else k))
+                      for k, v in spec['nodes'].iteritems())
+
+    batch = None
+    if 'batch' in spec:
+        batch = {key: (compile_spec({'xpath': '.', 'nodes': batch_nodes}, namespaces,
+                                    label='{0}[{1}]'.format(label, key)),
+                       {name: node['data'] for name, node in batch_nodes.iteritems()})
+                 for key, batch_nodes in spec['batch'].iteritems()}
+
+    # export to list of nodes is usually about keeping their data, not cloning first node
+    export_to = tuple(compile_spec(v, namespaces, fanout=isinstance(v, list),
+                                   label='{0}>exportTo[{1}]'.format(label, i))
+                      for i, v in enumerate(spec.get('exportTo', [])))
+
+    return SpecNode(
+        path=path,
+        xpath=compile_xpath(path, namespaces),
+        container=compile_xpath(spec.get('container', path), namespaces),
+        namespaces=namespaces,
+        many=many,
+        nodes=nodes,
+        keep=keep,
+        export=export,
+        use_default=not (keep and spec.get('default', None) is None),
+        default=spec.get('default', ''),
+        required=spec.get('required', False),
+        initial=spec.get('initial', None),
+        parser=spec.get('parser'),
+        attributes=tuple((attr, f, attribute_handler(f)) for attr, f in parse_attributes(spec).iteritems()),
+        export_to=export_to,
+        batch=batch,
+        remove_when=remove_when,
+        fanout=spec.get('fanout', fanout),
+        field=tuple((k, v) for k, v in spec.iteritems() if k not in SPECIAL_KEYS),
+        label=label,
+    )
 
-    if 'namespaces' in spec:
-        kwargs['namespaces'] = spec['namespaces']
 
-    eles = tree.xpath(spec['xpath'], **kwargs)
+def get_value_type(eles):
+    try:
+        return eles[0].getchildren()[0].tag
+    except:
+        return None
 
-    if spec.get('required') or 'nodes' in spec:
-        assert len(eles) > 0, "We require at least one xpath match for required fields and all branches.\n{0}\n{1}".format(spec['xpath'], eles)
 
-    field = spec.copy()
-    for special_key in SPECIAL_KEYS:
-        if special_key in field: del field[special_key]
+def extract(tree, spec, fields=True, data=True, **kwargs):
+    """
+    Field descriptors and data for a spec from a single walk of the tree.
 
-    if many:
-        field['many'] = True
-        field['initial'] = spec.get('initial', [])
-        if 'nodes' in spec:
-            field['fields'] = {k: extract_fields(eles[0], v, **kwargs)
-                               for k, v in spec['nodes'].iteritems()}
-        else:
+    Returns a (field, data) pair.  Pass fields=False or data=False to skip
+    either half, see extract_fields and extract_xml_data.
+    """
+    node = compile_spec(spec, kwargs.get('namespaces'))
+    with timed('spec'):
+        return extract_node(tree, node, fields, data)
+
+
+def extract_node(tree, node, fields, data):
+    eles = evaluate(node, node.xpath, tree)
+
+    if fields and (node.required or node.nodes is not None):
+        assert len(eles) > 0, "We require at least one xpath match for required fields and all branches.\n{0}\n{1}".format(node.path, eles)
+
+    field = dict(node.field) if fields else None
+    if fields:
+        if node.many:
+            field['many'] = True
+            field.setdefault('initial', [])
+        elif node.nodes is None:
+            field.setdefault('initial', None)
+        if node.nodes is None:
             field['type'] = get_value_type(eles)
 
-    elif 'nodes' in spec:
-        for k, v in spec['nodes'].iteritems():
-            field[k] = extract_fields(eles[0], v, **kwargs)
+    if not data:
+        if fields and node.nodes is not None:
+            children, _ = extract_children(eles[0], node, True, False)
+            if node.many:
+                field['fields'] = children
+            else:
+                field.update(children)
+        return field, None
+
+    if not isinstance(eles, list):
+        if node.use_default:
+            return field, get_default(node)
+        else:
+            return field, eles
 
+    if not node.many:
+        assert len(eles) < 2, \
+            "XPath must resolve to single element:\n" \
+            "ele: %s\n" \
+            "node: %s\n" \
+            "eles: %s" % (tree, node.path, eles)
+
+    if node.many:
+        rows = eles if node.keep else []
+        if node.nodes is None:
+            return field, [process_node_child(ele, node) for ele in rows]
+        values = []
+        if fields:
+            field['fields'], first = extract_children(eles[0], node, True, bool(rows))
+            if rows:
+                values.append(first)
+                rows = rows[1:]
+        values.extend(extract_children(ele, node, False, True)[1] for ele in rows)
+        return field, values
+    elif len(eles) == 0 and not node.required:
+        return field, fresh(node.initial)
+    elif len(eles) == 1:
+        if node.nodes is None:
+            return field, process_node_child(eles[0], node)
+        children, values = extract_children(eles[0], node, fields, True)
+        if fields:
+            field.update(children)
+        return field, values
     else:
-        field['type'] = get_value_type(eles)
-        field['initial'] = spec.get('initial', None)
+        assert len(eles) > 0, ["No matches for required", node.path, tree]
+
+
+def extract_children(ele, node, fields, data):
+    field, values = {}, {}
+    for k, v in node.nodes:
+        field[k], values[k] = extract_node(ele, v, fields, data)
+    return field, values
 
-    return field
+
+def extract_fields(tree, spec, **kwargs):
+    return extract(tree, spec, data=False, **kwargs)[0]
 
 
 def value(ele, **kwargs):
@@ -69,7 +298,7 @@ def value(ele, **kwargs):
     if ele is None:
         raise Exception("Expected a valid ele to extract value from")
 
-    value_ele = ele.xpath('*', **kwargs)
+    value_ele = CHILDREN_XPATH(ele)
     if value_ele and len(value_ele) == 1:
         value_ele = value_ele[0]
         value = value_ele.text
@@ -91,7 +320,7 @@ def value(ele, **kwargs):
 
         return value
 
-    texts = ele.xpath("text()")
+    texts = TEXT_XPATH(ele)
     if texts is None:
         pass
     elif len(texts) == 1:
@@ -100,71 +329,46 @@ def value(ele, **kwargs):
         assert "Didn't expect multiple results to text() xpath query: %s" % ele
 
 
-def get_default(spec):
-    default = spec.get('default', '')
-    if hasattr(default, '__call__'):
-        return default()
-    else:
-        return default
+def fresh(x):
+    # Values from the spec must not be shared between extracted documents
+    return deepcopy(x) if isinstance(x, (list, dict)) else x
 
 
-def process_node_child(ele, spec, **kwargs):
-    if 'nodes' in spec:
-        nodes = spec['nodes']
-        if isinstance(nodes, dict):
-            return {n: extract_xml_data(ele, s, **kwargs)
-                    for n, s in spec['nodes'].iteritems()}
-        else:
-            assert "Expected dict.  Got %s" % type(nodes)
+def get_default(node):
+    default = node.default
+    if hasattr(default, '__call__'):
+        return call(node, default)
     else:
-        if spec.get('keep', True) and spec.get('default', None) is None:
-            if 'parser' in spec:
-                return spec['parser'](ele)
-            else:
-                return value(ele, **kwargs)
-        else:
-            return get_default(spec)
+        return fresh(default)
 
 
-def extract_xml_data(tree, spec, **kwargs):
-    if isinstance(spec, list):
-        spec = spec[0]
-        many = True
+def process_node_child(ele, node):
+    if node.use_default:
+        return get_default(node)
+    elif node.parser is not None:
+        return call(node, node.parser, ele)
     else:
-        many = False
-
-    required = spec.get('required', False)
-    initial = spec.get('initial', None)
+        return value(ele)
 
-    if 'namespaces' in spec:
-        kwargs['namespaces'] = spec['namespaces']
 
-    eles = tree.xpath(spec['xpath'], **kwargs)
+def extract_xml_data(tree, spec, **kwargs):
+    return extract(tree, spec, fields=False, **kwargs)[1]
 
-    if not isinstance(eles, list):
-        if spec.get('keep', True) and spec.get('default', None) is None:
-            return eles
-        else:
-            return get_default(spec)
 
-    if not many:
-        assert len(eles) < 2, \
-            "XPath must resolve to single element:\n" \
-            "ele: %s\n" \
-            "node: %s\n" \
-            "eles: %s" % (tree, spec, eles)
-
-    if many:
-        if spec.get('keep', True):
-            return [process_node_child(ele, spec, **kwargs) for ele in eles]
-        else:
-            return []
-    elif len(eles) == 0 and not required:
-        return initial
-    elif len(eles) == 1:
-        return process_node_child(eles[0], spec, **kwargs)
-    else:
-        assert len(eles) > 0, ["No matches for required", spec["xpath"], tree]
+def apply_callable_defaults(data, spec):
+    """
+    Re-evaluate callable defaults (eg. today's date) in previously extracted data.
+    """
+    node = compile_spec(spec)
+    for k, v in node.nodes or ():
+        if v.many or k not in data:
+            continue
+        if v.nodes is not None:
+            if isinstance(data[k], dict):
+                apply_callable_defaults(data[k], v)
+        elif v.use_default and hasattr(v.default, '__call__'):
+            data[k] = call(v, v.default)
+    return data
 
 
 identity = lambda x: x
@@ -180,29 +384,48 @@ def parse_attributes(spec):
     return attrs
 
 
-def item_is_empty(data, k, v):
-    return k not in data or data[k] is None or data[k] == '' or ('removeWhen' in v and v['removeWhen'](data[k]))
+def attribute_handler(f):
+    """
+    Normalise an attribute function to handler(data, elem).
 
+    Attribute functions take either the data or the data and the value
+    currently in the template element.  Returns None if f takes neither.
+    """
+    try:
+        arity = len(inspect.getargspec(f)[0])
+    except TypeError:
+        return None
+    if arity == 1:
+        return lambda data, elem: f(data)
+    elif arity == 2:
+        return lambda data, elem: f(data, value(elem))
+
+
+def item_is_empty(data, k, node):
+    return k not in data or data[k] is None or data[k] == '' or (node.remove_when is not None and
+                                                                 node.remove_when(data[k]))
 
-def spec_data_from_batch(batch_spec, key):
+
+def spec_data_from_batch(batch, key):
     assert isinstance(key, string_types), ("Expected a string key, but got {0}".format(type(key).__name__))
-    data = {name: node['data'] for name, node in batch_spec[key].iteritems()}
-    spec = {'xpath': '.', 'nodes': batch_spec[key]}
-    return spec, data
+    return batch[key]
 
 
-def data_to_xml(data, parent, spec, nsmap, i=0, silent=True):
-    if isinstance(spec, list):
-        spec = spec[0]
-        xpath = spec.get('container', spec['xpath'])
-        container = parent.xpath(xpath, namespaces=nsmap)
-        if spec.get('fanout', False):
+def data_to_xml(data, parent, spec, nsmap=None, i=0, silent=True):
+    node = compile_spec(spec, nsmap)
+    with timed('spec'):
+        node_to_xml(data, parent, node, i, silent)
+
+
+def node_to_xml(data, parent, node, i=0, silent=True):
+    if node.many:
+        container = evaluate(node, node.container, parent)
+        if node.fanout:
             for i in range(len(container)):
-                data_to_xml(data, parent, spec, nsmap, i, silent)
+                element_to_xml(data, parent, node, i, silent)
         else:
             if len(container) < 1:
-                msg = "container at xpath %s is not found" % xpath
-                print parent
+                msg = "container at xpath %s is not found" % node.path
                 if silent:
                     logger.warning(msg)
                     return
@@ -214,34 +437,35 @@ def data_to_xml(data, parent, spec, nsmap, i=0, silent=True):
                 mount.remove(elem)
             for i, item in enumerate(data):
                 mount.append(deepcopy(template))
-                data_to_xml(item, parent, spec, nsmap, i, silent)
-    elif not spec.get('export', True):
-        if 'exportTo' in spec:
-            for v in spec['exportTo']:
-                data_to_xml(data, parent, v, nsmap, i, silent)
-    elif 'batch' in spec:
-        spec, data = spec_data_from_batch(spec['batch'], data)
-        data_to_xml(data, parent, spec, nsmap, 0, silent)
-    elif 'nodes' in spec:
-        parent = parent.xpath(spec['xpath'], namespaces=nsmap)[i]
-        for k, v in spec['nodes'].iteritems():
+                element_to_xml(item, parent, node, i, silent)
+    else:
+        element_to_xml(data, parent, node, i, silent)
+
+
+def element_to_xml(data, parent, node, i=0, silent=True):
+    if not node.export:
+        for v in node.export_to:
+            node_to_xml(data, parent, v, i, silent)
+    elif node.batch is not None:
+        batch_node, data = spec_data_from_batch(node.batch, data)
+        node_to_xml(data, parent, batch_node, 0, silent)
+    elif node.nodes is not None:
+        parent = evaluate(node, node.xpath, parent)[i]
+        for k, v in node.nodes:
             if item_is_empty(data, k, v):
-                if isinstance(v, list):
-                    v = v[0]
-                if v.get('required', False):
+                if v.required:
                     # at the moment, we are always graceful to missing fields, only reporting them w/o raising exception
                     logger.warning('%s field is required, but missing' % k)
-                xpath = v.get('container', v.get('xpath', None))
-                if xpath is not None:
-                    elems = parent.xpath(xpath, namespaces=nsmap)
+                if v.container is not None:
+                    elems = evaluate(v, v.container, parent)
                     for elem in elems:
                         elem.getparent().remove(elem)
                 continue
-            data_to_xml(data[k], parent, v, nsmap, 0, silent)
+            node_to_xml(data[k], parent, v, 0, silent)
     else:
-        elems = parent.xpath(spec['xpath'], namespaces=nsmap)
+        elems = evaluate(node, node.xpath, parent)
         if len(elems) < i + 1:
-            msg = 'element %s[%d] not found in template, not written' % (spec['xpath'], i)
+            msg = 'element %s[%d] not found in template, not written' % (node.path, i)
             if silent:
                 logger.warning(msg)
             else:
@@ -250,27 +474,18 @@ def data_to_xml(data, parent, spec, nsmap, i=0, silent=True):
         elem = elems[i]
         if len(elem.getchildren()) > 0:  # FIXME make explicit declaration in spec
             elem = elem.getchildren()[0]
-        for attr, f in parse_attributes(spec).iteritems():
-            arity = len(inspect.getargspec(f)[0])
-            if arity == 1:
-                v = f(data)
-            elif arity == 2:
-                source_value = value(elem, namespaces=nsmap)
-                v = f(data, source_value)
-            else:
-                msg = 'attr %s in spec %s has unsupported arity %d' % (attr, str(spec), arity)
+        for attr, f, handler in node.attributes:
+            if handler is None:
+                msg = 'attr %s in spec %s has unsupported function %r' % (attr, node.path, f)
                 if silent:
                     logger.warning(msg)
                     continue
                 else:
                     raise Exception(msg)
+            v = call(node, handler, data, elem)
             if attr == 'text':
                 elem.text = v
             else:
                 elem.set(attr, v)
-        if 'exportTo' in spec:
-            for v in spec['exportTo']:
-                # export to list of nodes is usually about keeping their data, not cloning first node
-                if isinstance(v, list):
-                    v[0]['fanout'] = True
-                data_to_xml(data, parent, v, nsmap, i, silent)
+        for v in node.export_to:
+            node_to_xml(data, parent, v, i, silent)
@@ -1,6 +1,17 @@
+from django.core.exceptions import PermissionDenied as DjangoPermissionDenied
 from rest_framework.exceptions import PermissionDenied
 
 
 def is_document_editor(request, doc):
     if not doc.is_editor(request.user):
         raise PermissionDenied()
+
+
+def require_document_editor(request, doc):
+    """
+    As is_document_editor, for lookups that also run outside REST framework
+    views (eg. condition functions).  Django's PermissionDenied gives a 403
+    either way.
+    """
+    if not doc.is_editor(request.user):
+        raise DjangoPermissionDenied()
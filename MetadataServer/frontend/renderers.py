@@ -0,0 +1,45 @@
+import re
+import uuid
+
+from rest_framework.renderers import JSONRenderer
+
+
+class RawJSON(object):
+    """
+    Already encoded JSON (eg. stored draft data) for PassthroughJSONRenderer
+    to write out as it is.  None (eg. no draft) is written as null.
+    """
+
+    def __init__(self, encoded):
+        if encoded is None:
+            encoded = b'null'
+        self.encoded = encoded.encode('utf-8') if isinstance(encoded, unicode) else encoded
+
+
+class PassthroughJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer which splices RawJSON values into its output, rather than
+    having them decoded and encoded again.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        raw = []
+        marker = uuid.uuid4().hex
+        encoder_class = self.encoder_class
+
+        class Encoder(encoder_class):
+            def default(self, obj):
+                if isinstance(obj, RawJSON):
+                    raw.append(obj.encoded)
+                    return '{0}:{1}'.format(marker, len(raw) - 1)
+                return super(Encoder, self).default(obj)
+
+        self.encoder_class = Encoder
+        try:
+            ret = super(PassthroughJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        finally:
+            del self.encoder_class
+        if not raw:
+            return ret
+        parts = re.split(b'"' + marker + b':(\\d+)"', ret)
+        return b''.join(raw[int(part)] if i % 2 else part for i, part in enumerate(parts))
@@ -1,3 +1,134 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
 from django.test import TestCase
 
-# Create your tests here.
+from backend.export import export_last_modified
+from backend.models import Document, DraftMetadata, MetadataTemplate, ScienceKeyword
+from frontend.renderers import PassthroughJSONRenderer, RawJSON
+
+
+class AutosaveTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('editor', password='password')
+        self.doc = Document.objects.create(owner=self.user)
+        self.data = {'identificationInfo': {'title': "Title", 'abstract': "Abstract"}}
+        DraftMetadata.objects.create(document=self.doc, user=self.user, data=self.data)
+        self.client.login(username='editor', password='password')
+
+    def revision(self):
+        return Document.objects.get(pk=self.doc.pk).revision
+
+    def autosave(self, body):
+        return self.client.post(reverse('Autosave', kwargs={'uuid': self.doc.uuid}), json.dumps(body),
+                                content_type='application/json', HTTP_ACCEPT='application/json')
+
+    def test_applies_patch(self):
+        base = self.revision()
+        response = self.autosave({'base': base, 'patch': [
+            {'op': 'replace', 'path': '/identificationInfo/abstract', 'value': "Patched"},
+            {'op': 'replace', 'path': '/identificationInfo/title', 'value': "New title"}]})
+        self.assertEqual(response.status_code, 200)
+        doc = Document.objects.get(pk=self.doc.pk)
+        self.assertEqual(json.loads(response.content)['revision'], doc.revision)
+        self.assertGreater(doc.revision, base)
+        self.assertEqual(doc.title, "New title")
+        self.assertEqual(doc.latest_draft.data['identificationInfo'], {'title': "New title", 'abstract': "Patched"})
+
+    def test_stale_base_conflicts(self):
+        base = self.revision()
+        patch = [{'op': 'replace', 'path': '/identificationInfo/abstract', 'value': "First"}]
+        self.assertEqual(self.autosave({'base': base, 'patch': patch}).status_code, 200)
+        response = self.autosave({'base': base, 'patch': [
+            {'op': 'replace', 'path': '/identificationInfo/abstract', 'value': "Second"}]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content)['revision'], self.revision())
+        abstract = Document.objects.get(pk=self.doc.pk).latest_draft.data['identificationInfo']['abstract']
+        self.assertEqual(abstract, "First")
+
+    def test_bad_input(self):
+        base = self.revision()
+        for body in ({'patch': []},
+                     {'base': "x", 'patch': []},
+                     {'base': base, 'patch': None},
+                     {'base': base, 'patch': [{'op': 'remove', 'path': '/missing'}]},
+                     {'base': base, 'patch': [{'op': 'remove', 'path': '/identificationInfo/title'}]},
+                     {'base': base, 'patch': {'op': 'remove', 'path': '/identificationInfo'}},
+                     {'base': base, 'patch': ["remove"]},
+                     {'base': base, 'patch': [{'op': 'replace', 'path': 1, 'value': "x"}]},
+                     {'base': base, 'patch': [{'op': 'move', 'from': None, 'path': '/a'}]},
+                     {'base': base, 'patch': [{'op': 'replace', 'path': '/identificationInfo/title'}]},
+                     {'base': base, 'patch': [{'path': '/identificationInfo/title', 'value': "x"}]}):
+            self.assertEqual(self.autosave(body).status_code, 400, body)
+        self.assertEqual(self.revision(), base)
+
+    def test_no_draft_conflicts(self):
+        doc = Document.objects.create(owner=self.user)
+        response = self.client.post(reverse('Autosave', kwargs={'uuid': doc.uuid}),
+                                    json.dumps({'base': doc.revision, 'patch': []}),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(DraftMetadata.objects.filter(document=doc).exists())
+
+    def test_other_users_forbidden(self):
+        User.objects.create_user('other', password='password')
+        self.client.login(username='other', password='password')
+        response = self.autosave({'base': self.revision(), 'patch': []})
+        self.assertEqual(response.status_code, 403)
+
+
+class PassthroughJSONRendererTest(TestCase):
+
+    def render(self, data):
+        return json.loads(PassthroughJSONRenderer().render(data))
+
+    def test_splices_raw_json(self):
+        data = {'form': {'data': RawJSON(u'{"title": "T\u00eftle", "tags": [1, 2]}'), 'other': RawJSON(b'[]')},
+                'revision': 3}
+        self.assertEqual(self.render(data), {'form': {'data': {'title': u"T\u00eftle", 'tags': [1, 2]}, 'other': []},
+                                             'revision': 3})
+
+    def test_none_written_as_null(self):
+        self.assertEqual(self.render({'data': RawJSON(None)}), {'data': None})
+
+    def test_plain_data(self):
+        self.assertEqual(self.render({'a': [1, "b"]}), {'a': [1, "b"]})
+
+
+class EditResourcesTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='password')
+        self.doc = Document.objects.create(owner=self.owner)
+        DraftMetadata.objects.create(document=self.doc, user=self.owner,
+                                     data={'identificationInfo': {'title': "Title"}})
+        User.objects.create_user('other', password='password')
+
+    def test_non_editor_forbidden(self):
+        self.client.login(username='other', password='password')
+        for name in ('Edit', 'EditBootstrap', 'EditDocument'):
+            response = self.client.get(reverse(name, kwargs={'uuid': self.doc.uuid}), HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 403, name)
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='password')
+        template = MetadataTemplate.objects.create(name="Template", file='template.xml', notes="")
+        self.doc = Document.objects.create(owner=self.owner, template=template)
+        User.objects.create_user('other', password='password')
+
+    def test_non_editor_forbidden(self):
+        self.client.login(username='other', password='password')
+        response = self.client.get(reverse('Export', kwargs={'uuid': self.doc.uuid}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_last_modified_follows_keywords(self):
+        doc = Document.objects.select_related('template').get(pk=self.doc.pk)
+        before = export_last_modified(doc, ScienceKeyword.objects.get_version())
+        ScienceKeyword.objects.create(Category="EARTH SCIENCE", Topic="OCEANS", Term="TIDES")
+        after = export_last_modified(doc, ScienceKeyword.objects.get_version())
+        self.assertGreater(after, before)
@@ -10,6 +10,11 @@ urlpatterns = patterns(
     url(r'^$', home, name="LandingPage"),
     url(r'^dashboard/$', dashboard, name="Dashboard"),
     url(r'^edit/(?P<uuid>\w{8}-\w{4}-\w{4}-\w{4}-\w{12})/$', edit, name="Edit"),
+    url(r'^edit/(?P<uuid>\w{8}-\w{4}-\w{4}-\w{4}-\w{12})/bootstrap/$', edit_bootstrap, name="EditBootstrap"),
+    url(r'^edit/(?P<uuid>\w{8}-\w{4}-\w{4}-\w{4}-\w{12})/document/$', edit_document_data, name="EditDocument"),
+    url(r'^edit/context/$', edit_context, name="EditContext"),
+    url(r'^templates/(?P<pk>\d+)/fields/$', template_fields, name="TemplateFields"),
+    url(r'^autosave/(?P<uuid>\w{8}-\w{4}-\w{4}-\w{4}-\w{12})/$', autosave, name="Autosave"),
     url(r'^transition/(?P<uuid>\w{8}-\w{4}-\w{4}-\w{4}-\w{12})/$', transition, name="Transition"),
     url(r'^clone/(?P<uuid>\w{8}-\w{4}-\w{4}-\w{4}-\w{12})/$', clone, name="Clone"),
     url(r'^upload/(?P<uuid>\w{8}-\w{4}-\w{4}-\w{4}-\w{12})/$', UploadView.as_view(), name="Upload"),
@@ -17,6 +22,10 @@ urlpatterns = patterns(
         name="DeleteAttachment"),
     url(r'^create/$', create, name="Create"),
     url(r'^theme/$', theme, name="Theme"),
+    url(r'^vocabulary/sciencekeywords/$', science_keywords, name="ScienceKeywords"),
+    url(r'^institutions/$', institutions, name="Institutions"),
+    url(r'^export/$', bulk_export, name="BulkExport"),
+    url(r'^export/progress/(?P<token>[\w-]+)/$', bulk_export_progress, name="BulkExportProgress"),
     url(r'^export/(?P<uuid>\w{8}-\w{4}-\w{4}-\w{4}-\w{12})/$', export, name="Export"),
     url(r'^api/', include(router.urls)),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
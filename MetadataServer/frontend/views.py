@@ -1,32 +1,47 @@
 # from frontend.router import rest_serialize
+import hashlib
+import re
+
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django_fsm import has_transition_perm
 from rest_framework import serializers
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework.response import Response
-from rest_framework.renderers import JSONRenderer
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
-from lxml import etree
 from django.shortcuts import get_object_or_404, render_to_response
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
 from django.template.context_processors import csrf
 
 from backend.models import Institution, DraftMetadata, Document, DocumentAttachment, ScienceKeyword, MetadataTemplate
 from backend.utils import to_json
+from backend.cache import get_template_fields, template_version
+from backend.patch import apply_patch, PatchError
+from backend.timing import TimedSerializerMixin
+from backend.export import (spec, export_chunks, gunzip_chunks, export_etag, export_last_modified, zip_response,
+                            start_progress, get_progress)
 from frontend.forms import DocumentAttachmentForm
 from frontend.models import SiteContent
-from frontend.permissions import is_document_editor
-from backend.xmlutils import extract_xml_data, extract_fields, data_to_xml
+from frontend.permissions import is_document_editor, require_document_editor
+from frontend.renderers import RawJSON, PassthroughJSONRenderer
 from backend.spec_2_0 import *
 
-spec = make_spec(science_keyword=ScienceKeyword)
+EXPORT_STYLES = ('compact', 'pretty')
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+UUID_RE = re.compile(r'^[0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}$')
+PROGRESS_TOKEN_RE = re.compile(r'^[\w-]{1,64}$')
 
 
 def theme_keywords():
@@ -34,6 +49,26 @@ def theme_keywords():
         'UUID', 'Topic', 'Term', 'VariableLevel1', 'VariableLevel2', 'VariableLevel3')
 
 
+def science_keyword_children(parent):
+    branches = set(path.rsplit(ScienceKeyword.PATH_SEPARATOR, 1)[0]
+                   for path in ScienceKeyword.objects.children(parent, levels=2).values_list('path', flat=True))
+    return [{"uuid": kw.UUID,
+             "name": kw.levels()[-1],
+             "path": kw.path,
+             "leaf": kw.path not in branches}
+            for kw in ScienceKeyword.objects.children(parent)]
+
+
+def science_keywords_etag(request):
+    version, last_modified = ScienceKeyword.objects.get_version()
+    return hashlib.md5(version + repr(request.GET.get('parent'))).hexdigest()
+
+
+def science_keywords_last_modified(request):
+    version, last_modified = ScienceKeyword.objects.get_version()
+    return last_modified
+
+
 def master_urls():
     return {
         "LandingPage": reverse("LandingPage"),
@@ -57,7 +92,7 @@ def messages_payload(request):
             for message in messages.get_messages(request)]
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     groups = serializers.StringRelatedField(many=True)
     permissions = serializers.SerializerMethodField()
 
@@ -76,13 +111,13 @@ class UserSerializer(serializers.ModelSerializer):
         return ["{0}.{1}".format(p.content_type.app_label, p.codename) for p in permissions]
 
 
-class UserInfoSerializer(serializers.ModelSerializer):
+class UserInfoSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('username', 'email', 'first_name', 'last_name')
 
 
-class DocumentInfoSerializer(serializers.ModelSerializer):
+class DocumentInfoSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     owner = UserInfoSerializer()
     url = serializers.SerializerMethodField()
     clone_url = serializers.SerializerMethodField()
@@ -107,19 +142,22 @@ class DocumentInfoSerializer(serializers.ModelSerializer):
         return reverse("Clone", kwargs={'uuid': doc.uuid})
 
     def get_last_updated(self, doc):
-        drafts = doc.draftmetadata_set
-        if drafts.exists():
-            return drafts.all()[0].time
+        if doc.latest_draft_id:
+            return doc.updated
 
     def get_status(self, doc):
         return doc.get_status_display()
 
     def get_transitions(self, doc):
-        return [t.method.__name__
-                for t in doc.get_available_user_status_transitions(self.context['user'])]
+        # Available transitions only depend on the status and the user, so work them out once per status
+        transitions = self.context.setdefault('transitions', {})
+        if doc.status not in transitions:
+            transitions[doc.status] = [t.method.__name__
+                                       for t in doc.get_available_user_status_transitions(self.context['user'])]
+        return transitions[doc.status]
 
 
-class AttachmentSerializer(serializers.ModelSerializer):
+class AttachmentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     delete_url = serializers.SerializerMethodField()
 
     class Meta:
@@ -130,7 +168,7 @@ class AttachmentSerializer(serializers.ModelSerializer):
         return reverse("DeleteAttachment", kwargs={'uuid': inst.document.uuid, 'id': inst.id})
 
 
-class SiteContentSerializer(serializers.ModelSerializer):
+class SiteContentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = SiteContent
         fields = ('title', 'organisation_url', 'email', 'tag_line', 'guide_pdf',
@@ -148,18 +186,52 @@ def user_status_list():
             if choice[0] != Document.DISCARDED]
 
 
+class DocumentPagination(CursorPagination):
+    """
+    Cursor pagination of dashboard documents.  Accepts `ordering` (one of
+    orderings) and `page_size` query params.
+    """
+    page_size = settings.DASHBOARD_PAGE_SIZE
+    max_page_size = 1000
+    ordering = '-updated'
+    orderings = ('updated', '-updated', 'title', '-title')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get('ordering')
+        if ordering in self.orderings:
+            return (ordering,)
+        return (self.ordering,)
+
+    def get_page_size(self, request):
+        try:
+            return min(int(request.query_params['page_size']), self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+
 @login_required
 @api_view()
 def dashboard(request):
     docs = (Document.objects
             .filter(owner=request.user)
             .exclude(status=Document.DISCARDED))
+    status_counts = dict(docs.order_by().values_list('status').annotate(Count('pk')))
+    docs = docs.select_related('owner')
+    if 'status' in request.query_params:
+        docs = docs.filter(status__in=request.query_params.getlist('status'))
+    paginator = DocumentPagination()
+    page = paginator.paginate_queryset(docs, request)
     return Response({
         "context": {
             "urls": master_urls(),
             "site": site_content(request.site),
             "user": UserSerializer(request.user).data,
-            "documents": DocumentInfoSerializer(docs, many=True, context={'user': request.user}).data,
+            "documents": DocumentInfoSerializer(page, many=True, context={'user': request.user}).data,
+            "documents_page": {
+                "next": paginator.get_next_link(),
+                "previous": paginator.get_previous_link(),
+            },
+            "status_counts": status_counts,
             "status": user_status_list()
         },
         "create_form": {
@@ -190,16 +262,15 @@ def create(request):
     template = get_object_or_404(
         MetadataTemplate, site=request.site, archived=False, pk=request.data['template'])
     try:
-        tree = etree.parse(template.file.path)
+        data = template.get_initial_data(spec)
         doc = Document.objects.create(title=request.data['title'],
                                       owner=request.user,
                                       template=template)
-        data = extract_xml_data(tree, spec)
         data['identificationInfo']['title'] = request.data['title']
-        data['fileIdentifier'] = doc.pk
+        data['fileIdentifier'] = str(doc.pk)
         DraftMetadata.objects.create(document=doc,
                                      user=request.user,
-                                     data=JSONRenderer().render(data))
+                                     data=data)
         return Response({"message": "Created",
                          "document": DocumentInfoSerializer(doc, context={'user': request.user}).data})
     except AssertionError as e:
@@ -211,7 +282,7 @@ def create(request):
 @login_required
 @api_view(['POST'])
 def clone(request, uuid):
-    orig_doc = get_object_or_404(Document, uuid=uuid)
+    orig_doc = get_object_or_404(Document.objects.select_related('latest_draft__base'), uuid=uuid)
     is_document_editor(request, orig_doc)
     try:
         doc = Document.objects.clone(orig_doc, request.user)
@@ -221,14 +292,99 @@ def clone(request, uuid):
         return Response({"message": e.message, "args": e.args}, status=400)
 
 
+def export_document(request, uuid):
+    # Looked up once per request for export and its condition functions,
+    # which run outside REST framework
+    if not hasattr(request, 'export_document'):
+        doc = get_object_or_404(Document.objects.select_related('template'), uuid=uuid)
+        require_document_editor(request, doc)
+        request.export_document = doc
+    return request.export_document
+
+
+def export_keywords(request):
+    # Science keyword version, looked up once per request like export_document
+    if not hasattr(request, 'export_keywords'):
+        request.export_keywords = ScienceKeyword.objects.get_version()
+    return request.export_keywords
+
+
+def export_style(request):
+    style = request.GET.get('style')
+    return style if style in EXPORT_STYLES else None
+
+
+def accepts_gzip(request):
+    return bool(ACCEPTS_GZIP_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def export_etag_func(request, uuid):
+    return export_etag(export_document(request, uuid), export_keywords(request),
+                       export_style(request), accepts_gzip(request))
+
+
+def export_last_modified_func(request, uuid):
+    return export_last_modified(export_document(request, uuid), export_keywords(request))
+
+
 @login_required
+@condition(etag_func=export_etag_func, last_modified_func=export_last_modified_func)
 def export(request, uuid):
-    doc = get_object_or_404(Document, uuid=uuid)
-    is_document_editor(request, doc)
-    data = to_json(doc.draftmetadata_set.all()[0].data)
-    xml = etree.parse(doc.template.file.path)
-    data_to_xml(data, xml, spec, spec['namespaces'])
-    return HttpResponse(etree.tostring(xml), content_type="application/xml")
+    """
+    XML export of the latest draft, streamed and gzipped if the client
+    accepts it.  Pass ?style=compact or ?style=pretty to reformat it.
+    """
+    doc = export_document(request, uuid)
+    chunks = export_chunks(doc, export_keywords(request), export_style(request))
+    gzipped = accepts_gzip(request)
+    if not gzipped:
+        chunks = gunzip_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type="application/xml; charset=utf-8")
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    # Clients keep the copy but revalidate it with the ETag each time
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+def bulk_export(request):
+    """
+    ZIP archive of documents chosen by uuid and/or filtered by status and
+    template.  Pass ?progress=<token> and poll bulk_export_progress to
+    follow a long export.
+    """
+    uuids = request.GET.getlist('uuid')
+    templates = request.GET.getlist('template')
+    token = request.GET.get('progress')
+    if not all(UUID_RE.match(uuid) for uuid in uuids):
+        return HttpResponseBadRequest("Invalid uuid")
+    if not all(template.isdigit() for template in templates):
+        return HttpResponseBadRequest("Invalid template")
+    if token is not None and not PROGRESS_TOKEN_RE.match(token):
+        return HttpResponseBadRequest("Invalid progress token")
+
+    docs = Document.objects.all()
+    if not request.user.is_staff:
+        docs = docs.filter(owner=request.user)
+    if uuids:
+        docs = docs.filter(uuid__in=uuids)
+    if 'status' in request.GET:
+        docs = docs.filter(status__in=request.GET.getlist('status'))
+    if templates:
+        docs = docs.filter(template__in=templates)
+    progress = start_progress(request.user, token) if token else None
+    return zip_response(docs, progress=progress)
+
+
+@login_required
+@api_view()
+def bulk_export_progress(request, token):
+    progress = get_progress(request.user, token)
+    if progress is None:
+        return Response({"message": "Unknown export"}, status=404)
+    return Response(progress)
 
 
 def home(request):
@@ -238,8 +394,10 @@ def home(request):
 
 @login_required
 @api_view(['GET', 'POST'])
+@renderer_classes((BrowsableAPIRenderer, PassthroughJSONRenderer))
 def edit(request, uuid):
-    doc = get_object_or_404(Document, uuid=uuid)
+    # The draft is only loaded to save over it, GET passes on its stored JSON
+    doc = get_object_or_404(Document.objects.select_related('template'), uuid=uuid)
     is_document_editor(request, doc)
 
     if request.method == 'POST':
@@ -247,62 +405,278 @@ def edit(request, uuid):
         if (doc.status == doc.SUBMITTED):
             doc.resubmit()
         doc.save()
-        inst = DraftMetadata.objects.create(document=doc, user=request.user, data=request.data)
-        tree = etree.parse(doc.template.file.path)
+        inst = DraftMetadata.objects.save_revision(doc, request.user, request.data)
         return Response({"messages": messages_payload(request),
                          "form": {
                              "url": reverse("Edit", kwargs={'uuid': doc.uuid}),
-                             "fields": extract_fields(tree, spec),
+                             "fields": get_template_fields(doc.template, spec),
                              "data": to_json(inst.data),
+                             "revision": doc.revision,
                              "document": DocumentInfoSerializer(doc, context={'user': request.user}).data}})
 
-    draft = doc.draftmetadata_set.all()[0]
-    data = to_json(draft.data)
-    tree = etree.parse(doc.template.file.path)
-
+    document = document_payload(request, doc)
     return Response({
-        "context": {
+        "context": dict(edit_context_payload(request),
+                        uuid=doc.uuid, title=doc.title, document=document["document"]),
+        "form": dict(document["form"], fields=get_template_fields(doc.template, spec)),
+        "upload_form": document["upload_form"],
+        "messages": messages_payload(request),
+        "data": document["form"]["data"],
+        "attachments": document["attachments"],
+        "theme": theme_payload(),
+        "institution_search": {"url": reverse("Institutions")},
+        "page": {"name": request.resolver_match.url_name}})
+
+
+def edit_context_payload(request):
+    # Built once per request for edit_context and its ETag
+    if not hasattr(request, 'edit_context'):
+        request.edit_context = {
             "site": site_content(request.site),
             "urls": master_urls(),
-            "uuid": doc.uuid,
             "user": UserSerializer(request.user).data,
-            "title": data['identificationInfo']['title'],
-            "document": DocumentInfoSerializer(doc, context={'user': request.user}).data,
-            "status": user_status_list()
+            "status": user_status_list()}
+    return request.edit_context
+
+
+def upload_form_payload(request, doc):
+    return {
+        "url": reverse("Upload", kwargs={'uuid': doc.uuid}),
+        "fields": {
+            'csrfmiddlewaretoken': {
+                'type': 'hidden',
+                'initial': str(csrf(request)['csrf_token'])
+            },
+            'document': {
+                'type': 'hidden',
+                'initial': str(doc.uuid),
+            },
+            'name': {
+                'type': 'text',
+                'required': True
+            },
+            'file': {
+                'type': 'file',
+                'required': True
+            }
         },
+        "data": {},
+    }
+
+
+def document_payload(request, doc):
+    return {
+        "uuid": doc.uuid,
+        "title": doc.title,
+        "document": DocumentInfoSerializer(doc, context={'user': request.user}).data,
         "form": {
             "url": reverse("Edit", kwargs={'uuid': doc.uuid}),
-            "fields": extract_fields(tree, spec),
-            "data": data,
-        },
-        "upload_form": {
-            "url": reverse("Upload", kwargs={'uuid': doc.uuid}),
-            "fields": {
-                'csrfmiddlewaretoken': {
-                    'type': 'hidden',
-                    'initial': str(csrf(request)['csrf_token'])
-                },
-                'document': {
-                    'type': 'hidden',
-                    'initial': uuid,
-                },
-                'name': {
-                    'type': 'text',
-                    'required': True
-                },
-                'file': {
-                    'type': 'file',
-                    'required': True
-                }
-            },
-            "data": {},
+            "autosave_url": reverse("Autosave", kwargs={'uuid': doc.uuid}),
+            "data": RawJSON(DraftMetadata.objects.latest_json(doc)),
+            "revision": doc.revision,
         },
-        "messages": messages_payload(request),
-        "data": data,
+        "upload_form": upload_form_payload(request, doc),
         "attachments": AttachmentSerializer(doc.attachments.all(), many=True).data,
-        "theme": {"table": theme_keywords()},
-        "institutions": [inst.to_dict() for inst in Institution.objects.all()],
-        "page": {"name": request.resolver_match.url_name}})
+    }
+
+
+def theme_payload():
+    return {"version": ScienceKeyword.objects.get_version()[0],
+            "url": reverse("ScienceKeywords")}
+
+
+def resource_version(*parts):
+    return hashlib.md5(":".join(map(unicode, parts)).encode('utf-8')).hexdigest()
+
+
+def versioned_url(url, version):
+    return "{0}?v={1}".format(url, version)
+
+
+def versioned_cache_control(request, response, version, public=False):
+    """
+    Responses requested at their current version (`v`) may be cached
+    indefinitely, others are revalidated against the ETag.
+    """
+    scope = {'public': True} if public else {'private': True}
+    if request.GET.get('v') == version:
+        patch_cache_control(response, max_age=settings.VOCABULARY_CACHE_MAX_AGE, **scope)
+    else:
+        patch_cache_control(response, no_cache=True, **scope)
+    return response
+
+
+def edit_document(request, uuid):
+    # Looked up once per request for the edit resources and their ETags
+    if not hasattr(request, 'edit_document'):
+        doc = get_object_or_404(Document.objects.select_related('template'), uuid=uuid)
+        # Also called by condition functions, before any REST framework handling
+        require_document_editor(request, doc)
+        request.edit_document = doc
+    return request.edit_document
+
+
+def edit_context_version(request):
+    return hashlib.md5(JSONRenderer().render(edit_context_payload(request))).hexdigest()
+
+
+def template_fields_version(template):
+    return resource_version(template.pk, template_version(template))
+
+
+def document_version(request, uuid):
+    doc = edit_document(request, uuid)
+    attachments = doc.attachments.aggregate(count=Count('id'), modified=Max('modified'))
+    return resource_version(doc.revision, doc.status,
+                            attachments['count'], attachments['modified'], csrf(request)['csrf_token'])
+
+
+def template_fields_etag(request, pk):
+    return template_fields_version(get_object_or_404(MetadataTemplate, pk=pk))
+
+
+@login_required
+@api_view()
+def edit_bootstrap(request, uuid):
+    """
+    Index of the resources making up the editor for a document, with their
+    versions.  Fetch them from the versioned URLs given to reuse cached
+    copies: the context is per user, the fields per template and the
+    document per revision.
+    """
+    doc = edit_document(request, uuid)
+    context_version = edit_context_version(request)
+    fields_version = template_fields_version(doc.template)
+    doc_version = document_version(request, uuid)
+    response = Response({
+        "uuid": doc.uuid,
+        "context": {"version": context_version,
+                    "url": versioned_url(reverse("EditContext"), context_version)},
+        "fields": {"version": fields_version,
+                   "url": versioned_url(reverse("TemplateFields", kwargs={'pk': doc.template_id}), fields_version)},
+        "document": {"version": doc_version,
+                     "url": versioned_url(reverse("EditDocument", kwargs={'uuid': doc.uuid}), doc_version)},
+        "theme": theme_payload(),
+        "institution_search": {"url": reverse("Institutions")},
+        "messages": messages_payload(request),
+        "page": {"name": "Edit"}})
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+@condition(etag_func=edit_context_version)
+@api_view()
+def edit_context(request):
+    """
+    Site content, URLs and user details for the editor.
+    """
+    response = Response(edit_context_payload(request))
+    return versioned_cache_control(request, response, edit_context_version(request))
+
+
+@login_required
+@condition(etag_func=template_fields_etag)
+@api_view()
+def template_fields(request, pk):
+    """
+    Field descriptors of a metadata template.
+    """
+    template = get_object_or_404(MetadataTemplate, pk=pk)
+    version = template_fields_version(template)
+    response = Response({"version": version, "fields": get_template_fields(template, spec)})
+    return versioned_cache_control(request, response, version)
+
+
+@login_required
+@condition(etag_func=document_version)
+@api_view()
+@renderer_classes((BrowsableAPIRenderer, PassthroughJSONRenderer))
+def edit_document_data(request, uuid):
+    """
+    A document's latest draft, details, attachments and upload form.
+    """
+    response = Response(document_payload(request, edit_document(request, uuid)))
+    return versioned_cache_control(request, response, document_version(request, uuid))
+
+
+@login_required
+@api_view(['POST'])
+def autosave(request, uuid):
+    """
+    Save changes to a document as a JSON patch (RFC 6902) against the
+    revision they were made to (`base`), eg.
+
+        {"base": 42, "patch": [{"op": "replace", "path": "/identificationInfo/abstract", "value": "..."}]}
+
+    Returns the new revision.  If the document has been saved since `base`
+    (or has no draft to patch) nothing is saved and the response is 409
+    with the latest revision.
+    """
+    try:
+        base, ops = int(request.data['base']), list(request.data['patch'])
+    except (KeyError, TypeError, ValueError):
+        return Response({"message": "Expected a base revision and a patch"}, status=400)
+
+    with transaction.atomic():
+        doc = get_object_or_404(Document.objects.select_for_update().select_related('latest_draft__base'),
+                                uuid=uuid)
+        is_document_editor(request, doc)
+        if doc.revision != base:
+            return Response({"message": "Document has changed", "revision": doc.revision}, status=409)
+        if doc.latest_draft is None:
+            return Response({"message": "Document has no draft to patch", "revision": doc.revision}, status=409)
+        try:
+            data = apply_patch(to_json(doc.latest_draft.data), ops)
+            title = data['identificationInfo']['title']
+        except (PatchError, KeyError, TypeError) as e:
+            return Response({"message": "Invalid patch", "args": e.args}, status=400)
+
+        doc.title = title or "Untitled"
+        if doc.status == doc.SUBMITTED:
+            doc.resubmit()
+        doc.save()
+        DraftMetadata.objects.save_revision(doc, request.user, data)
+    return Response({"revision": doc.revision, "status": doc.status})
+
+
+@condition(etag_func=science_keywords_etag, last_modified_func=science_keywords_last_modified)
+@api_view()
+def science_keywords(request):
+    """
+    Science keyword vocabulary.
+
+    Returns the whole table, or with a `parent` path just the keywords one
+    level below it.  See versioned_cache_control for caching.
+    """
+    version, last_modified = ScienceKeyword.objects.get_version()
+    if 'parent' in request.GET:
+        parent = request.GET['parent']
+        response = Response({
+            "version": version,
+            "parent": parent,
+            "children": science_keyword_children(parent)})
+    else:
+        response = Response({
+            "version": version,
+            "table": theme_keywords()})
+    return versioned_cache_control(request, response, version, public=True)
+
+
+class InstitutionPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+@api_view()
+def institutions(request):
+    """
+    Typeahead search of institutions by organisation name and city (`q`).
+    """
+    paginator = InstitutionPagination()
+    page = paginator.paginate_queryset(Institution.objects.search(request.GET.get('q', '')), request)
+    return paginator.get_paginated_response([inst.to_dict() for inst in page])
 
 
 @api_view()
@@ -352,6 +726,7 @@ def transition(request, uuid):
             raise PermissionDenied
         transition()
         doc.save()
+        doc.checkpoint()
         return Response({"message": "Success",
                          "document": DocumentInfoSerializer(doc, context={'user': request.user}).data})
     except RuntimeError as e:
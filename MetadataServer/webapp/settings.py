@@ -8,6 +8,36 @@ PROJECT_ROOT = path.dirname(path.abspath(path.dirname(__file__)))
 # Variables that local settings might override:
 DEBUG = True
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# Data derived from metadata templates is cached in the default cache.  Configure
+# a shared backend (eg memcached) in CACHES so worker processes can share it.
+TEMPLATE_CACHE_TIMEOUT = 60 * 60 * 24
+# Upper bound (in bytes of template source) on parsed template trees kept in each process.
+TEMPLATE_POOL_MAX_BYTES = 16 * 1024 * 1024
+# Lifetime of versioned vocabulary responses (eg. science keywords) in browser caches.
+VOCABULARY_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+# Documents per page on the dashboard
+DASHBOARD_PAGE_SIZE = 100
+# Draft revisions are stored as deltas, with a full snapshot at least this often
+DRAFT_SNAPSHOT_INTERVAL = 20
+# Saves by the same user within this many seconds update the latest revision rather than adding one
+DRAFT_COALESCE_WINDOW = 60
+# Lifetime of cached JSON of delta-encoded drafts, see DraftMetadataManager.latest_json
+DRAFT_JSON_CACHE_TIMEOUT = 60 * 60 * 24
+# Codec drafts are written with ('json' or 'zlib'), existing rows are rewritten by recode_drafts
+DRAFT_STORAGE_CODEC = 'zlib'
+# Outbox delivery (send_queued_email): failed emails are retried after
+# EMAIL_RETRY_DELAY seconds, doubling each time, up to EMAIL_MAX_ATTEMPTS.
+EMAIL_RETRY_DELAY = 60
+EMAIL_MAX_ATTEMPTS = 8
+# Cache alias (see CACHES) and lifetime for rendered XML exports
+EXPORT_CACHE = 'default'
+EXPORT_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# Bulk export loads and renders documents this many at a time
+BULK_EXPORT_CHUNK_SIZE = 50
+# How long bulk export progress stays available after the last update
+BULK_EXPORT_PROGRESS_TIMEOUT = 60 * 60
+# Log each request's Server-Timing breakdown as a JSON line (logger backend.timing)
+SERVER_TIMING_LOG = False
 ADMINS = (
     # ('Your Name', 'your_email@example.com'),
 )
@@ -121,6 +151,8 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # First, so it times the rest of the request
+    'backend.timing.ServerTimingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',